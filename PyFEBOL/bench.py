@@ -0,0 +1,295 @@
+'''
+bench.py
+
+Cedrick Argueta
+cdrckrgt@stanford.edu
+
+benchmarks for filters, sensors, cost models and policies.
+
+    python -m PyFEBOL.bench --output bench.json
+    python -m PyFEBOL.bench --baseline bench.json --tolerance 0.2
+
+results are written as json. with a baseline, every benchmark is compared to the
+saved timing and the exit code is 1 if any got slower than the tolerance allows.
+the exit code is also 1 if importing the package takes longer than --import-budget.
+'''
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from PyFEBOL import cost
+from PyFEBOL.drone import Drone
+from PyFEBOL.filter import DiscreteFilter, ExtendedKalmanFilter, ParticleFilter, QuadtreeFilter, UnscentedKalmanFilter
+from PyFEBOL.policy import InfoGainPolicy, MeanPolicy, POMCPPolicy
+from PyFEBOL.searchdomain import SearchDomain
+from PyFEBOL.sensor import BearingOnlySensor, FOVSensor
+
+PARTICLES = [1000, 10000, 100000, 1000000]
+BUCKETS = [25, 64, 128, 256, 512]
+QUICK_PARTICLES = [1000, 10000]
+QUICK_BUCKETS = [25, 64]
+
+IMPORT_BUDGET = 0.25 # seconds, for the modules a runner worker imports, numpy excluded
+IMPORTS = 'PyFEBOL, PyFEBOL.filter, PyFEBOL.sensor, PyFEBOL.drone, PyFEBOL.searchdomain, PyFEBOL.policy, PyFEBOL.cost, PyFEBOL.runner'
+
+LENGTH = 200.
+BUCKETS_PF = 64 # belief resolution for the particle filter benchmarks
+COST_PARTICLES = 10000
+
+def timeit(fn, repeat, setup=None):
+    '''
+    runs setup (untimed) then fn, repeat times. returns timing summary in seconds
+    '''
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times = np.array(times)
+    return {'median': float(np.median(times)), 'min': float(times.min()), 'repeat': repeat}
+
+def benchImport(results, repeat):
+    '''
+    import time of numpy, then of the package on top of it, each in a fresh interpreter
+    '''
+    script = ('import time; start = time.perf_counter(); import numpy; mid = time.perf_counter(); '
+              'import {}; print(mid - start, time.perf_counter() - mid)'.format(IMPORTS))
+    times = np.array([[float(t) for t in subprocess.check_output([sys.executable, '-c', script]).split()] for _ in range(repeat)])
+    for name, t in (('import numpy', times[:, 0]), ('import PyFEBOL', times[:, 1])):
+        results[name] = {'median': float(np.median(t)), 'min': float(t.min()), 'repeat': repeat}
+
+def _scenario(sensor, seed=0):
+    np.random.seed(seed)
+    domain = SearchDomain(LENGTH, init=(0.3, 0.6))
+    drone = Drone(25., 25., 60., 2.0, 15.0, sensor, domain)
+    return domain, drone
+
+def _warmFilter(f, domain, drone, steps=5):
+    # a few updates so the belief isn't uniform
+    for _ in range(steps):
+        f.update(drone.getPose(), drone.observe(domain))
+
+def benchParticleFilter(results, particles, repeat):
+    sensor = BearingOnlySensor(10.)
+    for n in particles:
+        domain, drone = _scenario(sensor)
+        f = ParticleFilter(domain, BUCKETS_PF, sensor, drone.maxStep, n)
+        _warmFilter(f, domain, drone)
+        pose = drone.getPose()
+        obs = drone.observe(domain)
+        tag = '[N={}]'.format(n)
+
+        results['ParticleFilter.update' + tag] = timeit(lambda: f.update(pose, obs), repeat)
+        results['ParticleFilter._predictParticles' + tag] = timeit(f._predictParticles, repeat)
+        results['ParticleFilter._updateParticles' + tag] = timeit(lambda: f._updateParticles(pose, obs), repeat)
+        results['ParticleFilter._resample' + tag] = timeit(f._resample, repeat)
+        # belief maps are lazy, dropping the caches makes the next call rebuild them
+        fleet = [(25., 25., 60.), (175., 25., 120.), (25., 175., 300.), (175., 175., 240.)]
+        fleetObs = [sensor.observe(domain.getTheta(), p) for p in fleet]
+        results['ParticleFilter.updateMany[K=4]' + tag] = timeit(lambda: f.updateMany(fleet, fleetObs), repeat)
+        results['ParticleFilter.update+getBeliefs' + tag] = timeit(lambda: (f.update(pose, obs), f.getBeliefs()), repeat)
+        results['ParticleFilter._updateBelief' + tag] = timeit(f._updateBelief, repeat, setup=f._invalidate)
+        results['ParticleFilter._updateTransformedBelief' + tag] = timeit(lambda: f._updateTransformedBelief(pose), repeat, setup=f._invalidate)
+
+        results['ParticleFilter.reset' + tag] = timeit(f.reset, repeat)
+        pooled = ParticleFilter(domain, BUCKETS_PF, sensor, drone.maxStep, n, poolSize=2)
+        pooled.reset() # builds the pool
+        results['ParticleFilter.reset(pool)' + tag] = timeit(pooled.reset, repeat)
+
+        # compact float32 particle state
+        domain, drone = _scenario(sensor)
+        f = ParticleFilter(domain, BUCKETS_PF, sensor, drone.maxStep, n, dtype=np.float32)
+        _warmFilter(f, domain, drone)
+        results['ParticleFilter.update(float32)' + tag] = timeit(lambda: f.update(pose, obs), repeat)
+
+def benchDiscreteFilter(results, buckets, repeat):
+    sensor = BearingOnlySensor(10.)
+    for b in buckets:
+        domain, drone = _scenario(sensor)
+        f = DiscreteFilter(domain, b, sensor)
+        pose = drone.getPose()
+        obs = drone.observe(domain)
+        tag = '[B={}]'.format(b)
+
+        # a new drone position every call, and the same one every call
+        positions = iter(np.random.rand(repeat, 2) * LENGTH)
+        def moving():
+            x, y = next(positions)
+            f.update((x, y, 0.), obs)
+        results['DiscreteFilter.update' + tag] = timeit(moving, repeat)
+        f.update(pose, obs)
+        results['DiscreteFilter.update(cached pose)' + tag] = timeit(lambda: f.update(pose, obs), repeat)
+
+        # moving target: a motion prediction before every update
+        for model in ('disk', 'gaussian'):
+            f = DiscreteFilter(domain, b, sensor, maxStep=drone.maxStep, motionModel=model)
+            f.update(pose, obs)
+            results['DiscreteFilter.update(moving, {})'.format(model) + tag] = timeit(lambda: f.update(pose, obs), repeat)
+
+        # after a few updates, so some cells are refined
+        f = QuadtreeFilter(domain, b, sensor)
+        _warmFilter(f, domain, drone, steps=20)
+        results['QuadtreeFilter.update' + tag] = timeit(lambda: f.update(pose, obs), repeat)
+        results['QuadtreeFilter.getBelief' + tag] = timeit(f.getBelief, repeat)
+
+def benchGaussianFilters(results, repeat):
+    sensor = BearingOnlySensor(10.)
+    for cls in (ExtendedKalmanFilter, UnscentedKalmanFilter):
+        domain, drone = _scenario(sensor)
+        f = cls(domain, BUCKETS_PF, sensor, drone.maxStep)
+        _warmFilter(f, domain, drone)
+        pose = drone.getPose()
+        obs = drone.observe(domain)
+        name = cls.__name__
+        results[name + '.update'] = timeit(lambda: f.update(pose, obs), repeat)
+        results[name + '.update+stats'] = timeit(lambda: (f.update(pose, obs), f.centroid(), f.entropy(), f.maxEigenvalue()), repeat)
+        results[name + '.getBelief[B={}]'.format(BUCKETS_PF)] = timeit(f.getBelief, repeat, setup=f._invalidate)
+
+def benchSensors(results, particles, repeat):
+    sensors = [('BearingOnlySensor', BearingOnlySensor(10.), 45.), ('FOVSensor', FOVSensor(0.1, 120., 25.), 1)]
+    pose = (25., 25., 60.)
+    for n in particles:
+        theta = (np.random.rand(n) * LENGTH, np.random.rand(n) * LENGTH)
+        out = np.empty(n)
+        tag = '[N={}]'.format(n)
+        for name, sensor, obs in sensors:
+            results[name + '.prob' + tag] = timeit(lambda: sensor.prob(theta, pose, obs), repeat)
+            results[name + '.prob(out=)' + tag] = timeit(lambda: sensor.prob(theta, pose, obs, out=out), repeat)
+
+def costModels():
+    return [
+        cost.ConstantCostModel(-1.),
+        cost.DistanceCostModel(),
+        cost.EntropyCostModel(),
+        cost.EntropyDistanceCostModel(0.1, 15.),
+        cost.HighestProbDistanceCostModel(0.1, 15.),
+        cost.MaxEigenvalDistanceCostModel(0.1, 15.),
+        cost.DiscreteProbDistanceCostModel(15., 0.1, 0.1),
+        cost.ThresholdProbDistanceCostModel(15., 0.1, 0.1),
+        cost.WeightedThresholdCostModel(15., 0.1, 0.1, 1., 1., 1.),
+        cost.ThresholdTrackingCostModel(15., 0.1, 0.1, 0.1),
+        cost.SimpleHCTCostModel(15., 1., 1., 1.),
+    ]
+
+def benchCostModels(results, particles, repeat):
+    sensor = BearingOnlySensor(10.)
+    for n in particles:
+        domain, drone = _scenario(sensor)
+        f = ParticleFilter(domain, BUCKETS_PF, sensor, drone.maxStep, n)
+        _warmFilter(f, domain, drone)
+        action = (0., 0., 0.)
+        tag = '[N={}]'.format(n)
+        for c in costModels():
+            # drop the per-step caches first, like a fresh update would
+            results[type(c).__name__ + '.getCost' + tag] = timeit(lambda: c.getCost(domain, drone, f, action), repeat, setup=f._invalidate)
+
+        # the collision term every distance cost model adds, against the norm over
+        # every particle the cost models used to take, and against building the index
+        def bruteForce():
+            pose = np.array(drone.getPose()[:2])
+            norms = np.linalg.norm(np.asarray([f.x_particles, f.y_particles]) - pose[:, np.newaxis], axis=0)
+            return np.sum(norms < 15.) / f.nb_particles
+        results['cost._collisionExpectation' + tag] = timeit(lambda: cost._collisionExpectation(f, drone, 15.), repeat, setup=f._invalidate)
+        results['cost._collisionExpectation(brute force)' + tag] = timeit(bruteForce, repeat)
+        results['ParticleGrid.build+query' + tag] = timeit(lambda: f.particleIndex().fractionWithin(*drone.getPose()[:2], 15.), repeat, setup=f._invalidate)
+
+def benchPolicies(results, repeat):
+    sensor = BearingOnlySensor(10.)
+    domain, drone = _scenario(sensor)
+    f = ParticleFilter(domain, BUCKETS_PF, sensor, drone.maxStep, COST_PARTICLES)
+    _warmFilter(f, domain, drone)
+    for numActions, headings in [(8, None), (36, [-1., 0., 1.])]:
+        p = MeanPolicy(drone.maxStep, numActions, headings)
+        tag = '[A={}]'.format(len(p.actions))
+        results['MeanPolicy.action' + tag] = timeit(lambda: p.action(domain, drone, None, f), repeat)
+        p = InfoGainPolicy(drone.maxStep, numActions, headings, rounds=1)
+        results['InfoGainPolicy.action' + tag] = timeit(lambda: p.action(domain, drone, None, f), repeat)
+        p = POMCPPolicy(drone.maxStep, numActions, headings, budget=np.inf, maxSimulations=100)
+        results['POMCPPolicy.action(100 simulations)' + tag] = timeit(lambda: p.action(domain, drone, None, f), repeat)
+
+def run(particles, buckets, repeat):
+    results = {}
+    benchImport(results, repeat)
+    benchParticleFilter(results, particles, repeat)
+    benchDiscreteFilter(results, buckets, repeat)
+    benchGaussianFilters(results, repeat)
+    benchSensors(results, particles, repeat)
+    benchCostModels(results, [n for n in particles if n <= 100000], repeat)
+    benchPolicies(results, repeat)
+    return results
+
+def compare(results, baseline, tolerance):
+    '''
+    returns the benchmarks whose median got slower than (1 + tolerance) times the baseline
+    '''
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name]['median'] / max(baseline[name]['median'], 1e-12)
+        flag = ''
+        if ratio > 1. + tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:<60s} {:>12.6f}s {:>12.6f}s {:>7.2f}x{}'.format(name, baseline[name]['median'], results[name]['median'], ratio, flag))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='PyFEBOL benchmarks')
+    parser.add_argument('--particles', type=int, nargs='+', default=None, help='particle counts to sweep')
+    parser.add_argument('--buckets', type=int, nargs='+', default=None, help='grid sizes to sweep')
+    parser.add_argument('--repeat', type=int, default=5, help='timed calls per benchmark')
+    parser.add_argument('--quick', action='store_true', help='small sweep, for a fast sanity check')
+    parser.add_argument('--output', default=None, help='write results to this json file')
+    parser.add_argument('--baseline', default=None, help='json file from a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown relative to the baseline')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET, help='seconds allowed to import the package, on top of numpy')
+    args = parser.parse_args(argv)
+
+    particles = args.particles or (QUICK_PARTICLES if args.quick else PARTICLES)
+    buckets = args.buckets or (QUICK_BUCKETS if args.quick else BUCKETS)
+    results = run(particles, buckets, args.repeat)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'particles': particles,
+            'buckets': buckets,
+            'repeat': args.repeat,
+            'importBudget': args.import_budget,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('{} benchmark(s) slower than the baseline allows'.format(len(regressions)))
+            status = 1
+    else:
+        for name in sorted(results):
+            print('{:<60s} {:>12.6f}s'.format(name, results[name]['median']))
+    if results['import PyFEBOL']['median'] > args.import_budget:
+        print('import PyFEBOL took {:.3f}s, over the {:.3f}s budget'.format(results['import PyFEBOL']['median'], args.import_budget))
+        status = 1
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
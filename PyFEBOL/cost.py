@@ -8,6 +8,16 @@ cost models
 '''
 import numpy as np
 
+def _collisionExpectation(filter_, drone, threshold):
+    '''
+    fraction of particles within threshold of the seeker, answered by the filter's
+    spatial index so only particles near the seeker are looked at
+    '''
+    x_seeker, y_seeker, _ = drone.getPose()
+    expectation = filter_.fractionWithin(x_seeker, y_seeker, threshold)
+    assert (expectation <= 1) and (expectation >= 0), 'expectation out of bounds'
+    return expectation
+
 class CostModel(object):
    def __init__(self):
         raise Exception("please instantiate a specific cost model, this is just a base class!")
@@ -67,11 +77,7 @@ class EntropyDistanceCostModel(CostModel):
     def getCost(self, domain, drone, filter_, action):
         entropy = filter_.entropy()
 
-        x_seeker, y_seeker, _ = drone.getPose()
-        pose = np.array([x_seeker, y_seeker])
-        norms = np.linalg.norm(np.asarray([filter_.x_particles, filter_.y_particles]) - pose[:, np.newaxis], axis=0)
-        expectation = np.sum(norms < self.threshold) / filter_.nb_particles
-        assert (expectation <= 1) and (expectation >= 0), 'expectation out of bounds'
+        expectation = _collisionExpectation(filter_, drone, self.threshold)
 
         expectation *= self.lambda_
 
@@ -90,11 +96,7 @@ class HighestProbDistanceCostModel(CostModel):
 
         max_prob = filter_.maxProbBucket()
         
-        x_seeker, y_seeker, _ = drone.getPose()
-        pose = np.array([x_seeker, y_seeker])
-        norms = np.linalg.norm(np.asarray([filter_.x_particles, filter_.y_particles]) - pose[:, np.newaxis], axis=0)
-        expectation = np.sum(norms < self.threshold) / filter_.nb_particles
-        assert (expectation <= 1) and (expectation >= 0), 'expectation out of bounds'
+        expectation = _collisionExpectation(filter_, drone, self.threshold)
 
         expectation *= self.lambda_
 
@@ -112,11 +114,7 @@ class MaxEigenvalDistanceCostModel(CostModel):
     def getCost(self, domain, drone, filter_, action):
         max_eig = filter_.maxEigenvalue()
 
-        x_seeker, y_seeker, _ = drone.getPose()
-        pose = np.array([x_seeker, y_seeker])
-        norms = np.linalg.norm(np.asarray([filter_.x_particles, filter_.y_particles]) - pose[:, np.newaxis], axis=0)
-        expectation = np.sum(norms < self.threshold) / filter_.nb_particles
-        assert (expectation <= 1) and (expectation >= 0), 'expectation out of bounds'
+        expectation = _collisionExpectation(filter_, drone, self.threshold)
 
         expectation *= self.lambda_
 
@@ -136,11 +134,7 @@ class DiscreteProbDistanceCostModel(CostModel):
 
         max_prob = filter_.maxProbBucket()
         
-        x_seeker, y_seeker, _ = drone.getPose()
-        pose = np.array([x_seeker, y_seeker])
-        norms = np.linalg.norm(np.asarray([filter_.x_particles, filter_.y_particles]) - pose[:, np.newaxis], axis=0)
-        expectation = np.sum(norms < self.distance_threshold) / filter_.nb_particles
-        assert (expectation <= 1) and (expectation >= 0), 'expectation out of bounds'
+        expectation = _collisionExpectation(filter_, drone, self.distance_threshold)
 
         reward = 1 if max_prob > self.entropy_threshold else 0
         reward = -1 if expectation > self.collision_threshold else reward
@@ -161,11 +155,7 @@ class ThresholdProbDistanceCostModel(CostModel):
 
         max_prob = filter_.maxProbBucket()
         
-        x_seeker, y_seeker, _ = drone.getPose()
-        pose = np.array([x_seeker, y_seeker])
-        norms = np.linalg.norm(np.asarray([filter_.x_particles, filter_.y_particles]) - pose[:, np.newaxis], axis=0)
-        expectation = np.sum(norms < self.distance_threshold) / filter_.nb_particles
-        assert (expectation <= 1) and (expectation >= 0), 'expectation out of bounds'
+        expectation = _collisionExpectation(filter_, drone, self.distance_threshold)
 
         belief_reward = max(float(max_prob - self.entropy_threshold) / float(1 - self.entropy_threshold), 0.0)
         collision_reward = self.lambda_ * expectation
@@ -194,11 +184,7 @@ class WeightedThresholdCostModel(CostModel):
         belief_reward = self.lambda_2 * -entropy
         
         # collision
-        x_seeker, y_seeker, _ = drone.getPose()
-        pose = np.array([x_seeker, y_seeker])
-        norms = np.linalg.norm(np.asarray([filter_.x_particles, filter_.y_particles]) - pose[:, np.newaxis], axis=0)
-        expectation = np.sum(norms < self.distance_threshold) / filter_.nb_particles
-        assert (expectation <= 1) and (expectation >= 0), 'expectation out of bounds'
+        expectation = _collisionExpectation(filter_, drone, self.distance_threshold)
         collision_reward = self.lambda_1 * expectation
 
         # tracking error
@@ -229,11 +215,7 @@ class ThresholdTrackingCostModel(CostModel):
 
         max_prob = filter_.maxProbBucket()
         
-        x_seeker, y_seeker, _ = drone.getPose()
-        pose = np.array([x_seeker, y_seeker])
-        norms = np.linalg.norm(np.asarray([filter_.x_particles, filter_.y_particles]) - pose[:, np.newaxis], axis=0)
-        expectation = np.sum(norms < self.distance_threshold) / filter_.nb_particles
-        assert (expectation <= 1) and (expectation >= 0), 'expectation out of bounds'
+        expectation = _collisionExpectation(filter_, drone, self.distance_threshold)
 
         tracking_error = np.linalg.norm(np.array(filter_.centroid()) - np.array(domain.getTheta()))
         # normalize by the domain length
@@ -265,12 +247,7 @@ class SimpleHCTCostModel(CostModel):
 
         norm_entropy = filter_.entropy() / np.log(filter_.buckets)
 
-        x_seeker, y_seeker, _ = drone.getPose()
-        pose = np.array([x_seeker, y_seeker])
-
-        norms = np.linalg.norm(np.asarray([filter_.x_particles, filter_.y_particles]) - pose[:, np.newaxis], axis=0)
-        expectation = np.sum(norms < self.distance_threshold) / filter_.nb_particles
-        assert (expectation <= 1) and (expectation >= 0), 'expectation out of bounds'
+        expectation = _collisionExpectation(filter_, drone, self.distance_threshold)
 
         tracking_error = np.linalg.norm(np.array(filter_.centroid()) - np.array(domain.getTheta()))
         # normalize by the domain length
@@ -28,6 +28,16 @@ class Drone(object):
         newHeading = (self.heading + shift) % 360. # ensuring that heading remains within 360 degrees
         return newX, newY, newHeading
 
+    def getNewPoses(self, actions):
+        '''
+        getNewPose for an [n, 3] array of actions at once, returns arrays x, y, heading
+        '''
+        actions = np.asarray(actions, dtype=float)
+        newX = self.x + actions[:, 0]
+        newY = self.y + actions[:, 1]
+        newHeading = (self.heading + self.headingMaxStep * actions[:, 2]) % 360.
+        return newX, newY, newHeading
+
     def act(self, action, nb_act_repeat=1):
         for _ in range(nb_act_repeat):
             newX, newY, newHeading = self.getNewPose(action)
@@ -35,6 +45,12 @@ class Drone(object):
             newX, newY = np.clip([newX, newY], 0, self.searchdomain.length)
             self.x, self.y, self.heading = newX, newY, newHeading
 
+    def getState(self):
+        return {'pose': np.array(self.getPose(), dtype=float)}
+
+    def setState(self, state):
+        self.x, self.y, self.heading = (float(v) for v in state['pose'])
+
     def observe(self, searchdomain):
         return self.sensor.observe(searchdomain.getTheta(), self.getPose())
 
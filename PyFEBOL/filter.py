@@ -7,9 +7,12 @@ cdrckrgt@stanford.edu
 filter stuff
 '''
 import numpy as np
-import scipy.stats as stats
 
-from fast_histogram import histogram2d as fhist2d
+from PyFEBOL import motion
+from PyFEBOL.resample import StratifiedResampler, ess
+from PyFEBOL.sensor import BearingOnlySensor
+from PyFEBOL.spatial import ParticleGrid
+from PyFEBOL import util
 
 class Filter(object):
     def __init__(self):
@@ -30,6 +33,12 @@ class Filter(object):
     def reset(self):
         raise Exception("Please instantitate a specific filter!")
 
+    def getState(self):
+        raise Exception("Please instantitate a specific filter!")
+
+    def setState(self, state):
+        raise Exception("Please instantitate a specific filter!")
+
     def getBelief(self):
         raise Exception("Please instantitate a specific filter!")
 
@@ -39,134 +48,664 @@ class Filter(object):
     def maxProbBucket(self):
         raise Exception("Please instantitate a specific filter!")
 
+    def _beliefStats(self):
+        '''
+        statistics of the current belief, computed together the first time any
+        of them is asked for and reused until the next update
+        '''
+        stats = getattr(self, '_stats', None)
+        if stats is None:
+            stats = self._stats = self._computeStats()
+        return stats
+
+    def _invalidate(self):
+        '''
+        drops everything cached about the belief, called whenever it changes
+        '''
+        self._stats = None
+
 
 class DiscreteFilter(Filter):
-    def __init__(self, domain, buckets, sensor):
+    '''
+    histogram filter over a buckets x buckets grid. rows are y, columns are x.
+
+    the bearing and distance from the drone to every cell center only depend on
+    the drone position, so they are cached for the last cacheSize positions
+    (rounded to poseResolution). revisiting a position then costs one likelihood
+    evaluation, a multiply and a normalize.
+
+    the target is static unless maxStep is given. then every update first predicts
+    where it moved, by convolving the belief with the motion kernel of a target
+    moving up to maxStep per step in any direction (see motion.predict for the two
+    kinds of motion). that covers both ConstantVelocityPolicy and RandomPolicy
+    targets, at O(buckets^2 log buckets) per step.
+    '''
+    def __init__(self, domain, buckets, sensor, cacheSize=32, poseResolution=1.e-3, maxStep=None, motionModel='disk'):
         self.domain = domain
+        self.maxStep = maxStep
+        self.motionModel = motionModel
         self.df = np.ones((buckets, buckets)) / (buckets ** 2) # buckets is num buckets per side
         self.sensor = sensor
         self.cellSize = domain.length / buckets
         self.buckets = buckets
+        self.poseResolution = poseResolution
 
-    def getBelief(self):
+        centers = (np.arange(buckets) + 0.5) * self.cellSize
+        self.x, self.y = np.meshgrid(centers, centers) # x changes along columns, y along rows
+        self.geometry = util.LRUCache(cacheSize)
+        self.prob = np.empty((buckets, buckets)) # likelihood workspace
+
+    def reset(self, rng=None):
+        '''
+        back to a uniform belief. the filter is deterministic, rng is only there to
+        match ParticleFilter.reset
+        '''
+        self.df.fill(1. / self.buckets ** 2)
+        self._invalidate()
+
+    def getState(self):
+        return {'df': self.df.copy()}
+
+    def setState(self, state):
+        np.copyto(self.df, state['df'])
+        self._invalidate()
+
+    def getBelief(self, out=None):
+        '''
+        [1, buckets, buckets] belief. out, if given, is filled in and returned instead
+        '''
+        if out is not None:
+            np.copyto(out, self.df[np.newaxis, :, :])
+            return out
         return self.df[np.newaxis, :, :] # adding a channel dimension
 
-    def update(self, pose, obs):
+    def _getGeometry(self, pose):
         '''
-        updates filter with new information (obs)
+        bearing and squared distance fields from the (quantized) drone position to every cell
         '''
+        key = (int(round(pose[0] / self.poseResolution)), int(round(pose[1] / self.poseResolution)))
+        fields = self.geometry.get(key)
+        if fields is None:
+            position = (key[0] * self.poseResolution, key[1] * self.poseResolution)
+            bearing = util.getTrueBearing((self.x, self.y), position)
+            distance2 = util.getDistance2((self.x, self.y), position)
+            fields = (bearing, distance2)
+            self.geometry.put(key, fields)
+        return fields
 
-        i, j = np.where(self.df > 0) # i is for rows, j is for columns
-        x = (j + 0.5) * self.cellSize
-        y = (i + 0.5) * self.cellSize
-        
-        dfUpdate = np.zeros(self.df.shape)
-        dfUpdate[i, j] = self.sensor.prob((x, y), pose, obs)
-        self.df *= dfUpdate
+    def update(self, pose, obs, nb_act_repeat=1):
+        '''
+        updates filter with new information (obs). with maxStep, the belief is first
+        moved by nb_act_repeat steps of the target, otherwise the target is static
+        '''
+        if self.maxStep is not None:
+            self.df[...] = motion.predict(self.df, self.cellSize, self.maxStep, self.motionModel, nb_act_repeat)
+        bearing, distance2 = self._getGeometry(pose)
+        self.sensor.likelihood(bearing, distance2, pose, obs, out=self.prob)
+        self.df *= self.prob
         self.df /= np.sum(self.df)
+        self._invalidate()
 
-    def centroid(self):
+    def _computeStats(self):
         centers = (np.arange(self.buckets) + 0.5) * self.cellSize
+        # rows are y, columns are x
+        (mu_y, mu_x, c_yy, c_xx, c_xy), entropy, max_prob = util.gridStats(self.df, centers)
+        m = np.array([[c_xx+1e-15, c_xy], [c_xy, c_yy+1e-15]])
+        return {'centroid': (mu_x, mu_y), 'covariance': m, 'entropy': entropy, 'maxProb': max_prob}
 
-        mu_x = np.sum(np.dot(self.df.T, centers))
-        mu_y = np.sum(np.dot(self.df, centers))
-
-        return mu_x, mu_y
+    def centroid(self):
+        return self._beliefStats()['centroid']
         
     def covariance(self):
-        centers = (np.arange(self.buckets) + 0.5) * self.cellSize
-
-        mu_x = np.sum(np.dot(self.df.T, centers))
-        mu_y = np.sum(np.dot(self.df, centers))
-        c_xx = np.sum(np.dot(self.df.T, centers ** 2)) - mu_x ** 2
-        c_yy = np.sum(np.dot(self.df, centers ** 2)) - mu_y ** 2
-        c_xy = np.sum(self.df.T * np.outer(centers, centers)) - mu_x * mu_y
-
-        m = np.array([[c_xx+1e-15, c_xy], [c_xy, c_yy+1e-15]])
-        return m
+        return self._beliefStats()['covariance']
 
     def entropy(self):
-        return stats.entropy(self.df.flatten())
+        return self._beliefStats()['entropy']
 
     def maxEigenvalue(self):
-        w, v = np.linalg.eig(self.covariance())
-        return np.max(w)
+        return util.maxEigenvalue(self.covariance())
     
     def maxProbBucket(self):
-        return self.getBelief().max()
+        return self._beliefStats()['maxProb']
+
+class LogDiscreteFilter(DiscreteFilter):
+    '''
+    histogram filter for large grids. the belief is kept as log probabilities of an
+    active set of cells, and a cell is dropped for good once its probability falls
+    below threshold times the largest one. updates and statistics only touch the
+    active cells, so after the belief collapses a 1024 x 1024 grid costs about as
+    much as the few cells that still hold mass.
+
+    statistics are exact over the retained mass. the dense belief is only built
+    when getBelief (or df) is asked for. same layout as DiscreteFilter: rows are y,
+    columns are x.
+
+    with maxStep, the prediction is done on the dense belief, and the active set is
+    rebuilt from it afterwards, so dropped cells come back as mass moves into them.
+    '''
+    def __init__(self, domain, buckets, sensor, threshold=1.e-10, maxStep=None, motionModel='disk'):
+        self.domain = domain
+        self.maxStep = maxStep
+        self.motionModel = motionModel
+        self.sensor = sensor
+        self.cellSize = domain.length / buckets
+        self.buckets = buckets
+        self.threshold = threshold
+        self._uniform()
+
+    def reset(self, rng=None):
+        self._uniform()
+
+    def getState(self):
+        return {'active': self.active.copy(), 'logp': self.logp.copy()}
+
+    def setState(self, state):
+        self._invalidate()
+        self.active = np.array(state['active'])
+        self.logp = np.array(state['logp'], dtype=float)
+        self._activeCenters()
+
+    def _uniform(self):
+        self._invalidate()
+        self.active = np.arange(self.buckets ** 2) # flat indices, row * buckets + column
+        self.logp = np.full(self.buckets ** 2, -2. * np.log(self.buckets))
+        self._activeCenters()
+
+    def _activeCenters(self):
+        self.x = (self.active % self.buckets + 0.5) * self.cellSize
+        self.y = (self.active // self.buckets + 0.5) * self.cellSize
+        self.prob = np.empty(len(self.active))
+
+    @property
+    def df(self):
+        df = np.zeros(self.buckets ** 2)
+        df[self.active] = np.exp(self.logp)
+        return df.reshape(self.buckets, self.buckets)
+
+    def getBelief(self, out=None):
+        if out is None:
+            return self.df[np.newaxis, :, :]
+        # scatter the active cells straight into out
+        out.fill(0.)
+        out.reshape(-1)[self.active] = np.exp(self.logp)
+        return out
+
+    def update(self, pose, obs, nb_act_repeat=1):
+        '''
+        updates filter with new information (obs). with maxStep, the belief is first
+        moved by nb_act_repeat steps of the target, otherwise the target is static
+        '''
+        if self.maxStep is not None:
+            self._predict(nb_act_repeat)
+        prob = self.sensor.prob((self.x, self.y), pose, obs, out=self.prob)
+        with np.errstate(divide='ignore'):
+            self.logp += np.log(prob)
+        self._normalize()
+
+        keep = self.logp >= self.logp.max() + np.log(self.threshold)
+        if not keep.all():
+            self.active = self.active[keep]
+            self.logp = self.logp[keep]
+            self._activeCenters()
+            self._normalize() # so the retained mass sums to one
+        self._invalidate()
+
+    def _predict(self, nb_act_repeat):
+        p = motion.predict(self.df, self.cellSize, self.maxStep, self.motionModel, nb_act_repeat).ravel()
+        self.active = np.flatnonzero(p >= p.max() * self.threshold)
+        with np.errstate(divide='ignore'):
+            self.logp = np.log(p[self.active])
+        self._activeCenters()
+        self._normalize()
+
+    def _normalize(self):
+        m = self.logp.max()
+        if not np.isfinite(m):
+            print('all entries in belief 0! resetting to a uniform belief')
+            self._uniform()
+            return
+        self.logp -= m + np.log(np.sum(np.exp(self.logp - m)))
+
+    def _computeStats(self):
+        p = np.exp(self.logp)
+        mu_x, mu_y = np.dot(p, self.x), np.dot(p, self.y)
+        c_xx = np.dot(p, self.x ** 2) - mu_x ** 2
+        c_yy = np.dot(p, self.y ** 2) - mu_y ** 2
+        c_xy = np.dot(p, self.x * self.y) - mu_x * mu_y
+
+        m = np.array([[c_xx+1e-15, c_xy], [c_xy, c_yy+1e-15]])
+        return {'centroid': (mu_x, mu_y), 'covariance': m, 'entropy': -np.dot(p, self.logp), 'maxProb': p.max()}
+
+class QuadtreeFilter(DiscreteFilter):
+    '''
+    histogram filter whose cells adapt to the belief. the domain starts as the usual
+    buckets x buckets grid, and every cell is the root of a quadtree: on each update,
+    leaves holding more than splitThreshold of the mass are split into four (down to
+    maxDepth levels below the grid), and groups of four sibling leaves holding less
+    than mergeThreshold together are merged back. a 64 grid with maxDepth 7 resolves
+    cells of length / 8192, while only the cells near the target are ever refined.
+
+    the leaves are kept as flat arrays: level, integer coordinates at that level
+    (ix, iy) and mass p. the likelihood is evaluated at leaf centers only, and
+    statistics are computed over the leaves (entropy and maxProbBucket are those of
+    the leaf masses). getBelief sums the leaves into the base grid, so it has the
+    same [1, buckets, buckets] shape and layout as DiscreteFilter (rows are y).
+    '''
+    def __init__(self, domain, buckets, sensor, maxDepth=6, splitThreshold=1.e-2, mergeThreshold=1.e-3):
+        assert mergeThreshold < splitThreshold, 'merged cells would be split again'
+        self.domain = domain
+        self.sensor = sensor
+        self.cellSize = domain.length / buckets
+        self.buckets = buckets
+        self.maxDepth = maxDepth
+        self.splitThreshold = splitThreshold
+        self.mergeThreshold = mergeThreshold
+        self._uniform()
+
+    def reset(self, rng=None):
+        self._uniform()
+
+    def getState(self):
+        return {'level': self.level.copy(), 'ix': self.ix.copy(), 'iy': self.iy.copy(), 'p': self.p.copy()}
+
+    def setState(self, state):
+        self._invalidate()
+        self.level = np.array(state['level'], dtype=np.int64)
+        self.ix = np.array(state['ix'], dtype=np.int64)
+        self.iy = np.array(state['iy'], dtype=np.int64)
+        self.p = np.array(state['p'], dtype=float)
+        self._leafCenters()
+
+    def _uniform(self):
+        self._invalidate()
+        cells = np.arange(self.buckets ** 2)
+        self.level = np.zeros(len(cells), dtype=np.int64)
+        self.ix = cells % self.buckets
+        self.iy = cells // self.buckets
+        self.p = np.full(len(cells), 1. / self.buckets ** 2)
+        self._leafCenters()
+
+    def _leafCenters(self):
+        size = self.cellSize / 2. ** self.level
+        self.x = (self.ix + 0.5) * size
+        self.y = (self.iy + 0.5) * size
+        self.prob = np.empty(len(self.p))
+
+    @property
+    def nb_leaves(self):
+        return len(self.p)
+
+    @property
+    def df(self):
+        # leaves summed into the base grid cell they belong to
+        cells = (self.iy >> self.level) * self.buckets + (self.ix >> self.level)
+        return np.bincount(cells, weights=self.p, minlength=self.buckets ** 2).reshape(self.buckets, self.buckets)
+
+    def getBelief(self, out=None):
+        if out is not None:
+            np.copyto(out, self.df[np.newaxis, :, :])
+            return out
+        return self.df[np.newaxis, :, :]
+
+    def update(self, pose, obs, nb_act_repeat=1):
+        '''
+        updates filter with new information (obs). heavy leaves are split first, so
+        their children are weighed by this observation. the target is assumed static,
+        nb_act_repeat is only there to match ParticleFilter.update
+        '''
+        self._split()
+        prob = self.sensor.prob((self.x, self.y), pose, obs, out=self.prob)
+        self.p *= prob
+        total = self.p.sum()
+        if not total > 0:
+            print('all entries in belief 0! resetting to a uniform belief')
+            self._uniform()
+            return
+        self.p /= total
+        self._merge()
+        self._invalidate()
+
+    def _split(self):
+        split = (self.p > self.splitThreshold) & (self.level < self.maxDepth)
+        if not split.any():
+            return
+        keep = ~split
+        # children at one level down: (2 ix + {0, 1}, 2 iy + {0, 1}), a quarter of the mass each
+        dx = np.array([0, 1, 0, 1])
+        dy = np.array([0, 0, 1, 1])
+        ix = (2 * self.ix[split, np.newaxis] + dx).ravel()
+        iy = (2 * self.iy[split, np.newaxis] + dy).ravel()
+        self.level = np.concatenate((self.level[keep], np.repeat(self.level[split] + 1, 4)))
+        self.ix = np.concatenate((self.ix[keep], ix))
+        self.iy = np.concatenate((self.iy[keep], iy))
+        self.p = np.concatenate((self.p[keep], np.repeat(self.p[split] / 4., 4)))
+        self._leafCenters()
+
+    def _merge(self):
+        below = self.level > 0
+        if not below.any():
+            return
+        # parents as one integer key, leaves sharing a key are siblings
+        width = self.buckets << self.maxDepth
+        key = np.where(below, ((self.level - 1) * width + (self.ix >> 1)) * width + (self.iy >> 1), -1)
+        parents, inverse, counts = np.unique(key, return_inverse=True, return_counts=True)
+        mass = np.bincount(inverse, weights=self.p)
+        # a parent can be rebuilt only if all four of its children are leaves
+        merge = (parents >= 0) & (counts == 4) & (mass < self.mergeThreshold)
+        if not merge.any():
+            return
+        merged = merge[inverse]
+        keep = ~merged
+        first = np.flatnonzero(merged)[np.unique(inverse[merged], return_index=True)[1]] # one child per merged parent
+        self.level = np.concatenate((self.level[keep], self.level[first] - 1))
+        self.ix = np.concatenate((self.ix[keep], self.ix[first] >> 1))
+        self.iy = np.concatenate((self.iy[keep], self.iy[first] >> 1))
+        self.p = np.concatenate((self.p[keep], mass[merge]))
+        self._leafCenters()
+
+    def _computeStats(self):
+        p = self.p
+        mu_x, mu_y = np.dot(p, self.x), np.dot(p, self.y)
+        c_xx = np.dot(p, self.x ** 2) - mu_x ** 2
+        c_yy = np.dot(p, self.y ** 2) - mu_y ** 2
+        c_xy = np.dot(p, self.x * self.y) - mu_x * mu_y
+
+        m = np.array([[c_xx+1e-15, c_xy], [c_xy, c_yy+1e-15]])
+        return {'centroid': (mu_x, mu_y), 'covariance': m, 'entropy': util.entropy(p), 'maxProb': p.max()}
 
 class ParticleFilter(Filter):
     '''
     simple particle filter with simple resampling, performed according to effective N updates
+
+    resampler is any Resampler from resample.py, stratified resampling when the
+    effective sample size drops below half the particles by default
+
+    if kld is a KLDSampler, the number of particles adapts every step to how many
+    buckets the belief occupies. nb_particles is then the initial count.
+
+    monitor is an optional FilterMonitor (see monitor.py) that gets stage timings,
+    ess, resample and reinitialization counts from every update.
+
+    the belief maps (world and transformed) are only rasterized when getBelief,
+    getTransformedBelief or a statistic first needs them after an update, both from
+    the same 10% subsample. a filter whose particles all left the domain is
+    reinitialized at the end of that update.
+
+    particles live in one preallocated (4, nb_particles) array, rows x, y, dx, dy
+    (x_particles etc. are views of it), and predict, weight update and resample all
+    work in place. dtype=np.float32 halves the memory of the particle state, the
+    weights always stay float64.
+
+    rng is a numpy Generator or seed (see util.getRNG) that all of the filter's
+    randomness comes from, including the default resampler's. process noise is
+    drawn from it in blocks covering many steps (util.NoiseBuffer). the belief
+    subsample comes from sampleRNG, a stream spawned from rng, so reading the
+    belief never changes the particles.
+
+    reset() starts a new episode in the existing buffers. with poolSize > 0 it copies
+    one of poolSize uniform particle clouds, generated once on the first reset, instead
+    of drawing a new one (from poolSeed if given, else from rng). the pool holds
+    poolSize * 4 * nb_particles numbers.
+
+    velocityNoise and positionNoise are the standard deviations of the process noise
+    added to particle velocities and positions every prediction.
     '''
-    def __init__(self, domain, buckets, sensor, maxStep, nb_particles):
+    def __init__(self, domain, buckets, sensor, maxStep, nb_particles, resampler=None, kld=None, monitor=None, dtype=np.float64, rng=None, poolSize=0, poolSeed=None, velocityNoise=0.05, positionNoise=1.0):
         self.domain = domain
         self.buckets = buckets
         self.sensor = sensor
         self.maxStep = maxStep
+        self.velocityNoise = velocityNoise
+        self.positionNoise = positionNoise
         self.cellSize = domain.length / buckets
         self.nb_particles = nb_particles
-        self.x_particles = np.random.uniform(0, domain.length, self.nb_particles)
-        self.dx_particles = np.random.uniform(-self.maxStep, self.maxStep, self.nb_particles)
-        self.y_particles = np.random.uniform(0, domain.length, self.nb_particles)
-        self.dy_particles = np.random.uniform(-self.maxStep, self.maxStep, self.nb_particles)
-        self.weights = np.ones(self.nb_particles) / self.nb_particles
+        self.rng = util.getRNG(rng)
+        self.sampleRNG = self.rng.spawn(1)[0]
+        self.noise = util.NoiseBuffer(self.rng, 4 * nb_particles, dtype=dtype)
+        self.resampler = resampler if resampler is not None else StratifiedResampler(rng=self.rng)
+        self.kld = kld
+        self.monitor = monitor
+        self.initialParticles = nb_particles
+        self.dtype = dtype
+        self.poolSize = poolSize
+        self.poolSeed = poolSeed
+        self.pool = None
+        self._allocate(nb_particles)
+        self._reinitialize()
+        self._uniformBeliefs()
+
+    def _uniformBeliefs(self):
+        self.pose = None # of the last update, for the transformed belief
         self.belief = np.ones((self.buckets, self.buckets)) / (self.buckets ** 2)
         self.belief = self.belief[np.newaxis, :, :]
         self.transformedBelief = np.ones((self.buckets, self.buckets)) / (self.buckets ** 2)
         self.transformedBelief = self.transformedBelief[np.newaxis, :, :]
 
-    def getTransformedBelief(self, norm=True):
+    def reset(self, rng=None):
+        '''
+        back to a uniform belief, as if just constructed. rng, if given, replaces the
+        filter's generator (and the default resampler's), e.g. one per episode
+        '''
+        if rng is not None:
+            self._setRNG(util.getRNG(rng))
+        if self.poolSize:
+            if self.pool is None:
+                self.pool = self._makePool()
+            if self.nb_particles != self.initialParticles:
+                self._allocate(self.initialParticles)
+            np.copyto(self.state, self.pool[self.rng.integers(len(self.pool))])
+            self.weights.fill(1. / self.nb_particles)
+        else:
+            self._reinitialize()
+        self._invalidate()
+        self._uniformBeliefs()
+
+    def _makePool(self):
+        rng = util.getRNG(self.poolSeed) if self.poolSeed is not None else self.rng
+        pool = np.empty((self.poolSize, 4, self.initialParticles), dtype=self.dtype)
+        pool[:, :2] = rng.uniform(0, self.domain.length, (self.poolSize, 2, self.initialParticles))
+        pool[:, 2:] = rng.uniform(-self.maxStep, self.maxStep, (self.poolSize, 2, self.initialParticles))
+        return pool
+
+    def _setRNG(self, rng):
+        if self.resampler.rng is self.rng:
+            self.resampler.rng = rng
+        self.rng = rng
+        self.sampleRNG = rng.spawn(1)[0]
+        self.noise = util.NoiseBuffer(rng, 4 * self.nb_particles, dtype=self.dtype)
+
+    def getState(self):
+        '''
+        everything needed to continue exactly where the filter is, as arrays
+        (see util.saveState). the belief maps are included if they have been computed.
+        the arrays are copies, so a snapshot kept in memory doesn't change as the
+        filter keeps updating, and can be restored any number of times
+        '''
+        state = {
+            'state': self.state.copy(),
+            'weights': self.weights.copy(),
+            'pose': np.array(self.pose if self.pose is not None else (np.nan,) * 3, dtype=float),
+            'rng': util.rngState(self.rng),
+            'sampleRNG': util.rngState(self.sampleRNG),
+        }
+        state.update(self.noise.getState())
+        if self.resampler.rng is not self.rng:
+            state['resamplerRNG'] = util.rngState(self.resampler.rng)
+        if self.belief is not None:
+            state['belief'] = self.belief.copy()
+        if self.transformedBelief is not None:
+            state['transformedBelief'] = self.transformedBelief.copy()
+        return state
+
+    def setState(self, state):
+        if state['state'].shape[1] != self.nb_particles:
+            self._allocate(state['state'].shape[1])
+        np.copyto(self.state, state['state'])
+        np.copyto(self.weights, state['weights'])
+        pose = tuple(float(v) for v in state['pose'])
+        self.pose = None if np.isnan(pose[0]) else pose
+        self.noise.setState(state)
+        util.setRNGState(self.rng, state['rng'])
+        util.setRNGState(self.sampleRNG, state['sampleRNG'])
+        if 'resamplerRNG' in state:
+            util.setRNGState(self.resampler.rng, state['resamplerRNG'])
+        self._invalidate()
+        if 'belief' in state:
+            self.belief = np.array(state['belief'])
+        if 'transformedBelief' in state:
+            self.transformedBelief = np.array(state['transformedBelief'])
+
+    def _reinitialize(self):
+        '''
+        spreads particles uniformly over the domain. an adaptive filter goes back to
+        its initial particle count, since a uniform belief needs many particles
+        '''
+        if self.kld is not None and self.nb_particles != self.initialParticles:
+            self._allocate(self.initialParticles)
+        self.state[:2] = self.rng.uniform(0, self.domain.length, (2, self.nb_particles))
+        self.state[2:] = self.rng.uniform(-self.maxStep, self.maxStep, (2, self.nb_particles))
+        self.weights.fill(1. / self.nb_particles)
+        self._invalidate()
+
+    def _allocate(self, nb_particles):
         '''
-        returns belief matrix centered on the drone pose and rotated according to pose
+        (re)allocates the particle state and its workspaces for nb_particles particles
         '''
-        belief = self.transformedBelief
-        if norm == False:
-            belief *= self.nb_particles 
-        return belief
+        self.nb_particles = nb_particles
+        self.state = np.zeros((4, nb_particles), dtype=self.dtype)
+        self.stateBuffer = np.empty_like(self.state) # resampling gathers into this, then the two swap
+        self.weights = np.empty(nb_particles)
+        self.prob = np.empty(nb_particles) # likelihood workspace
+
+    def _setRow(self, row, values):
+        if len(values) != self.nb_particles:
+            self._allocate(len(values))
+        self.state[row] = values
+
+    x_particles = property(lambda self: self.state[0], lambda self, v: self._setRow(0, v))
+    y_particles = property(lambda self: self.state[1], lambda self, v: self._setRow(1, v))
+    dx_particles = property(lambda self: self.state[2], lambda self, v: self._setRow(2, v))
+    dy_particles = property(lambda self: self.state[3], lambda self, v: self._setRow(3, v))
 
-    def _updateTransformedBelief(self, pose):
+    def _checkDomain(self):
+        '''
+        starts over from a uniform belief if no particle is left inside the belief's
+        range. done every update, so it doesn't depend on what is read from the filter
+        '''
+        hi = self.domain.length + 1
+        x, y = self.x_particles, self.y_particles
+        if ((x >= 0) & (x < hi) & (y >= 0) & (y < hi)).any():
+            return
+        print('all entries in belief matrix 0! this happens when belief is concentrated outside the search domain')
+        if self.monitor is not None:
+            self.monitor.recordReinitialize('world')
+        self._reinitialize()
+
+    def _emptyBelief(self):
+        # the subsample missed the grid (or the transformed belief's view of it)
+        return (np.ones((self.buckets, self.buckets)) / (self.buckets ** 2))[np.newaxis, :, :]
+
+    def _rasterStage(self, name, fn, *args):
+        if self.monitor is None:
+            return fn(*args)
+        return self.monitor.rasterStage(name, fn, *args)
+
+    def _beliefSample(self):
+        '''
+        the 10% subsample of particles both belief maps are built from, drawn and
+        gathered once per update. drawn from sampleRNG, so it doesn't move the
+        particle dynamics
+        '''
+        if self._sample is None:
+            sampled = self.sampleRNG.integers(self.nb_particles, size=int(self.nb_particles / 10)) # sample 10 % of particles for belief
+            self._sample = self.x_particles[sampled], self.y_particles[sampled], self.weights[sampled]
+        return self._sample
+
+    def _histogram(self, x, y, w):
+        return util.histogram2d(x, y, bins=self.buckets, range=[[0, self.domain.length + 1], [0, self.domain.length + 1]], weights=w)
+
+    def _raster(self, f):
+        '''
+        checks a fresh [buckets, buckets] histogram, returns the [1, buckets, buckets] belief
+        '''
+        assert np.isfinite(f.sum()), 'belief matrix contains nan values. filter: {}, weights: {}'.format(f, self.weights)
+        if not f.any():
+            return self._emptyBelief()
+        return f[np.newaxis, :, :] # add channel dimension
+
+    def _output(self, belief, norm, out):
+        if out is None:
+            return belief if norm else belief * self.nb_particles
+        if norm:
+            np.copyto(out, belief)
+        else:
+            np.multiply(belief, self.nb_particles, out=out)
+        return out
+
+    def getTransformedBelief(self, norm=True, out=None):
+        '''
+        returns belief matrix centered on the drone pose and rotated according to pose.
+        computed on first use after each update and kept until the next one. out, if
+        given, is a [1, buckets, buckets] array (e.g. a FrameStack slot) that the belief
+        is copied into and returned
+        '''
+        if self.transformedBelief is None:
+            self._rasterStage('_updateTransformedBelief', self._updateTransformedBelief)
+        return self._output(self.transformedBelief, norm, out)
+
+    def _updateTransformedBelief(self, pose=None):
+        pose = self.pose if pose is None else pose
         origin_length = 0.5 * self.domain.length
         x, y, heading = pose
 
-        sampled = np.random.randint(self.nb_particles, size=int(self.nb_particles / 10)) # sample 10 % of particles for belief
-        # get particles relative to seeker position
-        x_relative = (self.x_particles - x)[sampled]
-        y_relative = (self.y_particles - y)[sampled]
+        # get sampled particles relative to seeker position
+        xs, ys, ws = self._beliefSample()
+        x_relative = xs - x
+        y_relative = ys - y
 
         # rotate particles according to seeker heading
         theta = np.radians(heading)
         c, s = np.cos(theta), np.sin(theta)
-        R = np.array([[c, -s], [s, c]])
-        x_relative, y_relative = np.dot(R, np.asarray([x_relative, y_relative]))
+        x_relative, y_relative = c * x_relative - s * y_relative, s * x_relative + c * y_relative
 
         x_relative += origin_length
         y_relative += origin_length
 
         # discretize particles into matrix for neural net
         # x_relative, y_relative =  np.clip(x_relative, 0, self.domain.length), np.clip(y_relative, 0, self.domain.length)
-        f = fhist2d(x_relative, y_relative, bins=self.buckets, range=[[0, self.domain.length + 1], [0, self.domain.length + 1]], weights=self.weights[sampled])
-        f = f[np.newaxis, :, :] # add channel dimension
-        assert np.all(np.isfinite(f)), 'belief matrix contains nan values. filter: {}, weights: {}'.format(f, self.weights)
-        if np.all(f == 0):
-            print('all entries in belief matrix 0! this happens when belief is concentrated outside the search domain')
-            f = (np.ones((self.buckets, self.buckets)) / (self.buckets ** 2))[np.newaxis, :, :]
-            self.weights = np.ones(self.nb_particles) / self.nb_particles
-            self.x_particles = np.random.uniform(0, self.domain.length, self.nb_particles)
-            self.dx_particles = np.random.uniform(-self.maxStep, self.maxStep, self.nb_particles)
-            self.y_particles = np.random.uniform(0, self.domain.length, self.nb_particles)
-            self.dy_particles = np.random.uniform(-self.maxStep, self.maxStep, self.nb_particles)
-        self.transformedBelief = f
+        f = self._histogram(x_relative, y_relative, ws)
+        self.transformedBelief = self._raster(f)
 
+    def getBelief(self, norm=True, out=None):
+        '''
+        returns the true belief, centered at (half domain, half domain).
+        computed on first use after each update. out works as in getTransformedBelief
+        '''
+        if self.belief is None:
+            self._rasterStage('_updateBelief', self._updateBelief)
+        return self._output(self.belief, norm, out)
+
+    def getBeliefs(self, norm=True, out=None):
+        '''
+        (getBelief(norm), getTransformedBelief(norm)), both from one subsample.
+        out is an optional pair of output arrays
+        '''
+        out = (None, None) if out is None else out
+        return self.getBelief(norm, out[0]), self.getTransformedBelief(norm, out[1])
 
-    def getBelief(self, norm=True):
+    def getBeliefPyramid(self, levels=3, transformed=False):
         '''
-        returns the true belief, centered at (half domain, half domain)
+        the belief (or transformed belief) at levels resolutions, each half the size of
+        the one before, by summing 2x2 blocks. buckets has to be divisible by 2 ** (levels - 1)
         '''
-        belief = self.belief
-        if norm == False:
-            belief *= self.nb_particles 
-        return belief
+        assert self.buckets % 2 ** (levels - 1) == 0, 'buckets must be divisible by 2 ** (levels - 1)'
+        belief = self.getTransformedBelief() if transformed else self.getBelief()
+        pyramid = [belief]
+        for _ in range(levels - 1):
+            c, b, _ = belief.shape
+            belief = belief.reshape(c, b // 2, 2, b // 2, 2).sum(axis=(2, 4))
+            pyramid.append(belief)
+        return pyramid
 
     def _updateBelief(self):
         # discretize belief for input into neural net
@@ -178,42 +717,64 @@ class ParticleFilter(Filter):
         # for belief updates, we will clip the particles to the edge of the domain, 
         # regardless of where the particle actually is.
         # x_particles, y_particles =  np.clip(self.x_particles, 0, self.domain.length), np.clip(self.y_particles, 0, self.domain.length)
-        sampled = np.random.randint(self.nb_particles, size=int(self.nb_particles / 10)) # sample 10 % of particles for belief
-        x_particles, y_particles = self.x_particles[sampled], self.y_particles[sampled]
-        f = fhist2d(x_particles, y_particles, bins=self.buckets, range=[[0, self.domain.length + 1], [0, self.domain.length + 1]], weights=self.weights[sampled])
-        f = f[np.newaxis, :, :] # add channel dimension
-        assert np.all(np.isfinite(f)), 'belief matrix contains nan values. filter: {}, weights: {}'.format(f, self.weights)
-        if np.all(f == 0):
-            print('all entries in belief matrix 0! this happens when belief is concentrated outside the search domain')
-            f = (np.ones((self.buckets, self.buckets)) / (self.buckets ** 2))[np.newaxis, :, :]
-            self.weights = np.ones(self.nb_particles) / self.nb_particles
-            self.x_particles = np.random.uniform(0, self.domain.length, self.nb_particles)
-            self.dx_particles = np.random.uniform(-self.maxStep, self.maxStep, self.nb_particles)
-            self.y_particles = np.random.uniform(0, self.domain.length, self.nb_particles)
-            self.dy_particles = np.random.uniform(-self.maxStep, self.maxStep, self.nb_particles)
-        self.belief = f
+        f = self._histogram(*self._beliefSample())
+        self.belief = self._raster(f)
 
     def _predictParticles(self, nb_act_repeat=1):
         '''
         during particle filter updates, we need a certain amount of variance
         to combat particle deprivation. how much noise is good?
         '''
-        self.dx_particles += np.random.randn(self.nb_particles) * 0.05
-        self.dy_particles += np.random.randn(self.nb_particles) * 0.05
+        position, velocity = self.state[:2], self.state[2:]
+        noise = self.noise.take(4 * self.nb_particles).reshape(4, self.nb_particles) # rows: dx, dy, x, y noise
+
+        noise[:2] *= self.velocityNoise
+        velocity += noise[:2]
 
-        self.x_particles += nb_act_repeat * self.dx_particles + np.random.randn(self.nb_particles) * 1.0 # noisy prediction
-        self.y_particles += nb_act_repeat * self.dy_particles + np.random.randn(self.nb_particles) * 1.0
+        noise[2:] *= self.positionNoise # noisy prediction
+        np.multiply(velocity, nb_act_repeat, out=noise[:2]) # reuse the spent velocity noise rows
+        position += noise[:2]
+        position += noise[2:]
  
         # self.x_particles = np.clip(self.x_particles, 0, self.domain.length)
         # self.y_particles = np.clip(self.y_particles, 0, self.domain.length)
 
-        self.dx_particles = np.clip(self.dx_particles, -self.maxStep, self.maxStep)
-        self.dy_particles = np.clip(self.dy_particles, -self.maxStep, self.maxStep)
+        np.clip(velocity, -self.maxStep, self.maxStep, out=velocity)
         
     def _updateParticles(self, pose, obs):
-        prob = self.sensor.prob((self.x_particles, self.y_particles), pose, obs)
+        prob = self.sensor.prob((self.x_particles, self.y_particles), pose, obs, out=self.prob)
+        self._weigh(prob)
+
+    def _updateParticlesMany(self, poses, obs, sensors):
+        '''
+        weighs the particles by the product of the likelihoods of all observations,
+        summed in log space. observations from the same sensor object are evaluated
+        in one [k, nb_particles] call
+        '''
+        groups = {}
+        for i, sensor in enumerate(sensors):
+            groups.setdefault(id(sensor), (sensor, []))[1].append(i)
+
+        loglik = self.prob
+        loglik.fill(0.)
+        for sensor, idxs in groups.values():
+            if getattr(self, '_probMany', None) is None or self._probMany.shape[1] != self.nb_particles or len(self._probMany) < len(idxs):
+                self._probMany = np.empty((max(len(idxs), len(sensors)), self.nb_particles)) # workspace for batched likelihoods
+            pose = tuple(np.array([poses[i][j] for i in idxs], dtype=float)[:, np.newaxis] for j in range(3))
+            o = np.array([obs[i] for i in idxs], dtype=float)[:, np.newaxis]
+            prob = sensor.prob((self.x_particles, self.y_particles), pose, o, out=self._probMany[:len(idxs)])
+            with np.errstate(divide='ignore'):
+                np.log(prob, out=prob)
+            loglik += prob.sum(axis=0)
+
+        # exponentiate relative to the best particle, so many small likelihoods don't underflow
+        loglik -= loglik.max()
+        np.exp(loglik, out=loglik)
+        self._weigh(loglik)
+
+    def _weigh(self, prob):
         self.weights *= prob
-        self.weights = np.nan_to_num(self.weights) # we get problems with nan with larger numbers of particles
+        np.nan_to_num(self.weights, copy=False) # we get problems with nan with larger numbers of particles
         self.weights += 1.e-300 # when numbers get too small, they become nan. then we convert nan to 0 and add a small number
         self.weights /= self.weights.sum()
         # if np.all(self.weights == 0):
@@ -222,43 +783,138 @@ class ParticleFilter(Filter):
         assert not np.all(self.weights == 0), 'all weights 0! x, y: {}, {}'.format(self.x_particles, self.y_particles)
         assert np.all(np.isfinite(self.weights)), 'weights contains nan values: weights: {}, prob: {}'.format(self.weights, prob)
 
-    def _stratifiedResample(self):
-        positions = (np.random.rand(self.nb_particles) + range(self.nb_particles)) / self.nb_particles
-        cumsum = np.cumsum(self.weights)
-        idxs = np.zeros(self.nb_particles, dtype=int)
-        i, j = 0, 0
-        while i < self.nb_particles: # for all subdivisions
-            # short circuit j, since sometimes our floating points get too close to 1.0
-            if (j == self.nb_particles - 1) or (positions[i] < cumsum[j]): 
-                idxs[i] = j # choose this particle in subdivision
-                i += 1 # move index to next subdivision
-            else: # move onto next particle in subdivision
-                j += 1
-        self.x_particles = self.x_particles[idxs]
-        self.y_particles = self.y_particles[idxs]
-        self.dx_particles = self.dx_particles[idxs]
-        self.dy_particles = self.dy_particles[idxs]
-        self.weights = np.ones(self.nb_particles) / self.nb_particles
+    def _resample(self, nb_particles=None):
+        '''
+        draws nb_particles particles (the current number if None) from the weights
+        '''
+        if self.monitor is not None:
+            self.monitor.recordResample()
+        idxs = self.resampler.resample(self.weights, nb_particles)
+        if len(idxs) == self.nb_particles:
+            # indices from the resampler are always in range. mode='clip' skips the
+            # bounds check, with the default 'raise' numpy gathers into a temporary first
+            np.take(self.state, idxs, axis=1, out=self.stateBuffer, mode='clip')
+            self.state, self.stateBuffer = self.stateBuffer, self.state
+        else: # adaptive filter changed size
+            state = self.state[:, idxs]
+            self._allocate(len(idxs))
+            self.state[...] = state
+        self.weights.fill(1. / self.nb_particles)
+
+    def _occupiedBuckets(self):
+        '''
+        expected number of distinct buckets hit when drawing nb_particles particles
+        from the weights, using the same binning as the belief
+        '''
+        scale = self.buckets / (self.domain.length + 1)
+        ix = np.clip((self.x_particles * scale).astype(int), 0, self.buckets - 1)
+        iy = np.clip((self.y_particles * scale).astype(int), 0, self.buckets - 1)
+        mass = np.bincount(ix * self.buckets + iy, weights=self.weights, minlength=self.buckets ** 2)
+        mass = mass[mass > 0] / mass.sum()
+        return np.sum(-np.expm1(self.nb_particles * np.log1p(-np.minimum(mass, 1. - 1.e-12))))
 
     def _resampleParticles(self):
-        if ((1. / np.sum(np.square(self.weights))) < (self.nb_particles / 2)):
-            self._stratifiedResample()
+        if self.kld is not None:
+            n = self.kld.nbParticles(self._occupiedBuckets())
+            if self.kld.needsResize(self.nb_particles, n):
+                self._resample(n)
+                return
+        if self.resampler.needsResample(self.weights):
+            self._resample()
 
     def update(self, pose, obs, nb_act_repeat=1):
+        if self.monitor is not None:
+            return self._monitoredUpdate(pose, nb_act_repeat, self._updateParticles, pose, obs)
         self._predictParticles(nb_act_repeat)
         self._updateParticles(pose, obs)
         self._resampleParticles()
-        self._updateBelief()
-        self._updateTransformedBelief(pose)
+        self._checkDomain()
+        self.pose = pose
+        self._invalidate()
+
+    def updateMany(self, poses, obs, sensors=None, nb_act_repeat=1):
+        '''
+        one update fusing the observations of several drones: poses is [k, 3] (or k
+        poses), obs the k observations and sensors the k sensors that made them
+        (all self.sensor if None), which may be of different types. the particles are
+        predicted, weighed by all k likelihoods and resampled once.
+        the transformed belief is centered on the first pose
+        '''
+        sensors = [self.sensor] * len(obs) if sensors is None else sensors
+        assert len(poses) == len(obs) == len(sensors), 'need one pose and one sensor per observation'
+        pose = tuple(poses[0])
+        if self.monitor is not None:
+            return self._monitoredUpdate(pose, nb_act_repeat, self._updateParticlesMany, poses, obs, sensors)
+        self._predictParticles(nb_act_repeat)
+        self._updateParticlesMany(poses, obs, sensors)
+        self._resampleParticles()
+        self._checkDomain()
+        self.pose = pose
+        self._invalidate()
+
+    def _monitoredUpdate(self, pose, nb_act_repeat, weigh, *args):
+        # same as update, but every stage goes through the monitor
+        monitor = self.monitor
+        monitor.stage('_predictParticles', self._predictParticles, nb_act_repeat)
+        monitor.stage('_updateParticles', weigh, *args)
+        monitor.recordESS(ess(self.weights))
+        monitor.stage('_resampleParticles', self._resampleParticles)
+        self._checkDomain()
+        self.pose = pose
+        self._invalidate()
+        monitor.recordUpdate(self.nb_particles)
+
+    def _computeStats(self):
+        # covariance is taken over the belief histogram (rows are x), as is
+        centers = (np.arange(self.buckets) + 0.5) * self.cellSize
+        (mu_x, mu_y, c_xx, c_yy, c_xy), entropy, max_prob = util.gridStats(self.getBelief()[0], centers)
+        m = np.array([[c_xx+1e-15, c_xy], [c_xy, c_yy+1e-15]])
+        return {'covariance': m, 'entropy': entropy, 'maxProb': max_prob}
 
     def entropy(self):
-        f = self.getBelief()
-        return stats.entropy(f.flatten()) 
+        return self._beliefStats()['entropy']
 
     def centroid(self):
-        mean_x = np.average(self.x_particles, weights=self.weights)
-        mean_y = np.average(self.y_particles, weights=self.weights)
-        return mean_x, mean_y
+        '''
+        weighted mean of the particles. cached apart from the histogram statistics,
+        so asking for it doesn't rasterize the belief
+        '''
+        if self._centroid is None:
+            self._centroid = (np.average(self.x_particles, weights=self.weights), np.average(self.y_particles, weights=self.weights))
+        return self._centroid
+
+    def _invalidate(self):
+        # belief maps are rebuilt lazily, from a new subsample
+        Filter._invalidate(self)
+        self._centroid = None
+        self._index = None
+        self._sample = None
+        self.belief = None
+        self.transformedBelief = None
+
+    def particleIndex(self):
+        '''
+        spatial index over the current particles, built on first use after each update
+        '''
+        if getattr(self, '_index', None) is None:
+            self._index = ParticleGrid(self.domain.length, self.cellSize).build(self.x_particles, self.y_particles, self.weights)
+        return self._index
+
+    def fractionWithin(self, x, y, r, weighted=False):
+        '''
+        fraction of particles within r of (x, y), counted (as the cost models do) or
+        by weight. x and y can be arrays of query points, e.g. candidate drone positions.
+        a single point is counted directly unless the index is already built, building
+        it only pays off over several queries
+        '''
+        if np.ndim(x) == 0 and getattr(self, '_index', None) is None:
+            d2 = (self.x_particles - x) ** 2
+            d2 += (self.y_particles - y) ** 2
+            inside = d2 < r ** 2
+            if weighted:
+                return np.dot(inside, self.weights) / self.weights.sum()
+            return np.count_nonzero(inside) / self.nb_particles
+        return self.particleIndex().fractionWithin(x, y, r, weighted)
     
     def mean_velocity(self):
         mean_dx = np.average(self.dx_particles, weights=self.weights)
@@ -266,21 +922,242 @@ class ParticleFilter(Filter):
         return mean_dx, mean_dy
 
     def covariance(self):
-        f = self.getBelief().squeeze(0)
-        centers = (np.arange(self.buckets) + 0.5) * self.cellSize
-
-        mu_x = np.sum(np.dot(f.T, centers))
-        mu_y = np.sum(np.dot(f, centers))
-        c_xx = np.sum(np.dot(f.T, centers ** 2)) - mu_x ** 2
-        c_yy = np.sum(np.dot(f, centers ** 2)) - mu_y ** 2
-        c_xy = np.sum(f.T * np.outer(centers, centers)) - mu_x * mu_y
-
-        m = np.array([[c_xx+1e-15, c_xy], [c_xy, c_yy+1e-15]])
-        return m
+        return self._beliefStats()['covariance']
     
     def maxEigenvalue(self):
-        w, v = np.linalg.eig(self.covariance())
-        return np.max(w)
+        return util.maxEigenvalue(self.covariance())
     
     def maxProbBucket(self):
-        return self.getBelief().max()
+        return self._beliefStats()['maxProb']
+
+class GaussianFilter(Filter):
+    '''
+    base for the kalman filters: the belief is one gaussian over the state
+    (x, y, dx, dy), with the same constant velocity model and process noise as
+    ParticleFilter. updates and statistics cost the same whatever the belief looks like:
+        - entropy and maxProbBucket are the closed forms for a gaussian binned into
+          cells of cellSize, clipped to what a buckets x buckets grid allows
+        - fractionWithin uses a fixed set of nb_samples standard normal draws, mapped
+          through the current covariance
+        - getBelief and getTransformedBelief rasterize the gaussian only when asked,
+          in the same layout as ParticleFilter (rows are x, range [0, length + 1])
+    the initial belief matches ParticleFilter's uniform start: centered on the domain,
+    with the variances of uniform positions and velocities. the mean is kept inside the
+    domain, and its velocity within maxStep.
+    only BearingOnlySensor is supported. a single gaussian can't hold the early, banana
+    shaped belief, so these need the drone to move across the bearing lines to converge.
+    '''
+    def __init__(self, domain, buckets, sensor, maxStep, velocityNoise=0.05, positionNoise=1.0, nb_samples=512, rng=None):
+        assert isinstance(sensor, BearingOnlySensor), 'gaussian filters only support BearingOnlySensor'
+        self.domain = domain
+        self.buckets = buckets
+        self.sensor = sensor
+        self.maxStep = maxStep
+        self.velocityNoise = velocityNoise
+        self.positionNoise = positionNoise
+        self.cellSize = domain.length / buckets
+        self.rng = util.getRNG(rng)
+        self.samples = self.rng.standard_normal((2, nb_samples))
+        self.models = {} # nb_act_repeat -> (F, Q)
+        self.reset()
+
+    def reset(self, rng=None):
+        '''
+        back to the initial belief. a new rng also redraws the samples for fractionWithin
+        '''
+        if rng is not None:
+            self.rng = util.getRNG(rng)
+            self.samples = self.rng.standard_normal(self.samples.shape)
+        length = self.domain.length
+        self.mean = np.array([0.5 * length, 0.5 * length, 0., 0.])
+        self.cov = np.diag([length ** 2 / 12., length ** 2 / 12., self.maxStep ** 2 / 3., self.maxStep ** 2 / 3.])
+        self.pose = None
+        self._invalidate()
+
+    def getState(self):
+        return {'mean': self.mean.copy(), 'cov': self.cov.copy(), 'pose': np.array(self.pose if self.pose is not None else (np.nan,) * 3, dtype=float),
+                'rng': util.rngState(self.rng), 'samples': self.samples.copy()}
+
+    def setState(self, state):
+        self.mean = np.array(state['mean'], dtype=float)
+        self.cov = np.array(state['cov'], dtype=float)
+        util.setRNGState(self.rng, state['rng'])
+        self.samples = np.array(state['samples'], dtype=float)
+        pose = tuple(float(v) for v in state['pose'])
+        self.pose = None if np.isnan(pose[0]) else pose
+        self._invalidate()
+
+    def _model(self, nb_act_repeat):
+        model = self.models.get(nb_act_repeat)
+        if model is None:
+            # velocity gets noise, then position moves by nb_act_repeat * velocity plus noise
+            n, qv, qp = nb_act_repeat, self.velocityNoise ** 2, self.positionNoise ** 2
+            F = np.eye(4)
+            F[0, 2] = F[1, 3] = n
+            Q = np.zeros((4, 4))
+            Q[0, 0] = Q[1, 1] = n * n * qv + qp
+            Q[2, 2] = Q[3, 3] = qv
+            Q[0, 2] = Q[2, 0] = Q[1, 3] = Q[3, 1] = n * qv
+            model = self.models[nb_act_repeat] = (F, Q)
+        return model
+
+    def _predict(self, nb_act_repeat=1):
+        F, Q = self._model(nb_act_repeat)
+        self.mean = F.dot(self.mean)
+        self.cov = F.dot(self.cov).dot(F.T) + Q
+
+    def update(self, pose, obs, nb_act_repeat=1):
+        self._predict(nb_act_repeat)
+        self._correct(pose, obs)
+        self._constrain()
+        self.pose = pose
+        self._invalidate()
+
+    def _constrain(self):
+        # the target stays in the domain, and its velocity is bounded like the particles'
+        np.clip(self.mean[:2], 0., self.domain.length, out=self.mean[:2])
+        np.clip(self.mean[2:], -self.maxStep, self.maxStep, out=self.mean[2:])
+        self.cov = 0.5 * (self.cov + self.cov.T)
+
+    def _computeStats(self):
+        c = self.cov[:2, :2]
+        det = max(c[0, 0] * c[1, 1] - c[0, 1] ** 2, 1.e-30)
+        area = self.cellSize ** 2
+        entropy = np.log(2. * np.pi * np.e * np.sqrt(det) / area)
+        max_prob = area / (2. * np.pi * np.sqrt(det))
+        return {'centroid': (self.mean[0], self.mean[1]), 'covariance': c + 1e-15 * np.eye(2),
+                'entropy': float(np.clip(entropy, 0., 2. * np.log(self.buckets))), 'maxProb': float(min(max_prob, 1.))}
+
+    def centroid(self):
+        return self._beliefStats()['centroid']
+
+    def covariance(self):
+        return self._beliefStats()['covariance']
+
+    def entropy(self):
+        return self._beliefStats()['entropy']
+
+    def maxEigenvalue(self):
+        return util.maxEigenvalue(self.covariance())
+
+    def maxProbBucket(self):
+        return self._beliefStats()['maxProb']
+
+    def fractionWithin(self, x, y, r, weighted=False):
+        '''
+        probability that the target is within r of (x, y), from the fixed samples.
+        weighted is only there to match ParticleFilter.fractionWithin
+        '''
+        chol = np.linalg.cholesky(self.cov[:2, :2] + 1.e-9 * np.eye(2))
+        sx, sy = chol.dot(self.samples) + self.mean[:2, np.newaxis]
+        inside = (sx - np.asarray(x, dtype=float)[..., np.newaxis]) ** 2 + (sy - np.asarray(y, dtype=float)[..., np.newaxis]) ** 2 < r ** 2
+        return inside.mean(axis=-1)
+
+    def _rasterize(self, mean, cov, out):
+        '''
+        gaussian density at the cell centers of the belief grid, times the cell area
+        '''
+        if out is None:
+            out = np.empty((1, self.buckets, self.buckets))
+        side = (self.domain.length + 1.) / self.buckets
+        centers = (np.arange(self.buckets) + 0.5) * side
+        dx = centers - mean[0]
+        dy = centers - mean[1]
+        det = max(cov[0, 0] * cov[1, 1] - cov[0, 1] ** 2, 1.e-30)
+        a, b, c = cov[1, 1] / det, -cov[0, 1] / det, cov[0, 0] / det # inverse covariance
+        q = out[0]
+        np.multiply.outer(a * dx * dx, np.ones(self.buckets), out=q) # rows are x
+        q += 2. * b * np.multiply.outer(dx, dy)
+        q += c * dy * dy
+        q *= -0.5
+        np.exp(q, out=q)
+        q *= side * side / (2. * np.pi * np.sqrt(det))
+        return out
+
+    def getBelief(self, norm=True, out=None):
+        '''
+        the gaussian rasterized like ParticleFilter.getBelief. norm is only there to
+        match ParticleFilter, there are no particles to count
+        '''
+        if out is None:
+            belief = getattr(self, '_belief', None)
+            if belief is None:
+                belief = self._belief = self._rasterize(self.mean, self.cov, None)
+            return belief
+        return self._rasterize(self.mean, self.cov, out)
+
+    def getTransformedBelief(self, norm=True, out=None):
+        '''
+        the gaussian in the drone's frame (centered on the last pose and rotated by
+        its heading), rasterized like ParticleFilter.getTransformedBelief
+        '''
+        if self.pose is None:
+            belief = np.ones((1, self.buckets, self.buckets)) / (self.buckets ** 2)
+            if out is not None:
+                np.copyto(out, belief)
+                return out
+            return belief
+        x, y, heading = self.pose
+        theta = np.radians(heading)
+        c, s = np.cos(theta), np.sin(theta)
+        R = np.array([[c, -s], [s, c]])
+        mean = R.dot(self.mean[:2] - (x, y)) + 0.5 * self.domain.length
+        cov = R.dot(self.cov[:2, :2]).dot(R.T)
+        return self._rasterize(mean, cov, out)
+
+    def _invalidate(self):
+        Filter._invalidate(self)
+        self._belief = None
+
+def _bearing(state, pose):
+    return np.degrees(np.arctan2(state[1] - pose[1], state[0] - pose[0]))
+
+def _wrap(angle):
+    return (angle + 180.) % 360. - 180.
+
+class ExtendedKalmanFilter(GaussianFilter):
+    '''
+    bearing-only EKF: the bearing is linearized around the predicted mean
+    '''
+    def _correct(self, pose, obs):
+        dx = self.mean[0] - pose[0]
+        dy = self.mean[1] - pose[1]
+        r2 = max(dx * dx + dy * dy, 1.e-6)
+        H = np.array([-dy / r2, dx / r2, 0., 0.]) * (180. / np.pi)
+        PH = self.cov.dot(H)
+        S = H.dot(PH) + self.sensor.sigma ** 2
+        K = PH / S
+        self.mean += K * _wrap(obs - np.degrees(np.arctan2(dy, dx)))
+        self.cov -= np.outer(K, PH)
+
+class UnscentedKalmanFilter(GaussianFilter):
+    '''
+    bearing-only UKF, with 2n + 1 sigma points (alpha, beta, kappa as in wan & van der
+    merwe). bearings of the sigma points are averaged on the circle
+    '''
+    def __init__(self, domain, buckets, sensor, maxStep, velocityNoise=0.05, positionNoise=1.0, nb_samples=512, rng=None, alpha=1., beta=2., kappa=0.):
+        n = 4
+        self.lambda_ = alpha ** 2 * (n + kappa) - n
+        self.wm = np.full(2 * n + 1, 0.5 / (n + self.lambda_))
+        self.wc = self.wm.copy()
+        self.wm[0] = self.lambda_ / (n + self.lambda_)
+        self.wc[0] = self.wm[0] + 1. - alpha ** 2 + beta
+        GaussianFilter.__init__(self, domain, buckets, sensor, maxStep, velocityNoise, positionNoise, nb_samples, rng)
+
+    def _correct(self, pose, obs):
+        n = len(self.mean)
+        chol = np.linalg.cholesky((n + self.lambda_) * self.cov + 1.e-9 * np.eye(n))
+        points = np.empty((2 * n + 1, n))
+        points[0] = self.mean
+        points[1:n + 1] = self.mean + chol.T
+        points[n + 1:] = self.mean - chol.T
+
+        z = _bearing(points.T, pose)
+        z = z[0] + _wrap(z - z[0]) # unwrapped around the first point
+        zMean = self.wm.dot(z)
+        dz = z - zMean
+        S = self.wc.dot(dz * dz) + self.sensor.sigma ** 2
+        Pxz = (self.wc * dz).dot(points - self.mean)
+        K = Pxz / S
+        self.mean += K * _wrap(obs - zMean)
+        self.cov -= S * np.outer(K, K)
@@ -0,0 +1,126 @@
+'''
+monitor.py
+
+Cedrick Argueta
+cdrckrgt@stanford.edu
+
+counters and timings for what goes on inside filter updates
+'''
+import time
+import tracemalloc
+
+class FilterMonitor(object):
+    '''
+    pass one to ParticleFilter(monitor=...) to collect, per update stage:
+        - stageTime: total wall time in seconds
+        - stageCalls: number of calls
+        - stageAllocated: total peak bytes allocated by python/numpy during the
+          stage, only if trackAllocations (uses tracemalloc, which is slow)
+    and per filter:
+        - updates, resamples, reinitializations
+        - ess: effective sample size after the last weight update, and essMin/essMean
+
+    callback, if given, is called as callback(event, info) after every update
+    ('update', with that update's stage times, ess and whether it resampled),
+    every time the filter has to start over from a uniform belief ('reinitialize'),
+    and after every lazy belief rasterization ('raster', with the stage name, its
+    time and the number of updates so far). rasterization happens when the belief
+    is first read after an update, so its time isn't part of that update's stages,
+    but it still goes into stageTime and stageCalls.
+
+    without a monitor the filter doesn't time anything, so leaving it off costs nothing.
+    '''
+    def __init__(self, callback=None, trackAllocations=False):
+        self.callback = callback
+        self.trackAllocations = trackAllocations
+        self.reset()
+
+    def reset(self):
+        self.stageTime = {}
+        self.stageCalls = {}
+        self.stageAllocated = {}
+        self.updates = 0
+        self.resamples = 0
+        self.reinitializations = 0
+        self.ess = None
+        self.essMin = None
+        self.essSum = 0.
+        self._step = {}
+
+    @property
+    def essMean(self):
+        return self.essSum / self.updates if self.updates else None
+
+    def stage(self, name, fn, *args):
+        '''
+        calls fn(*args), recording how long it took (and how much it allocated)
+        as part of the current update
+        '''
+        result, elapsed = self._timed(name, fn, args)
+        self._step[name] = elapsed
+        return result
+
+    def rasterStage(self, name, fn, *args):
+        '''
+        same as stage, for work done between updates: reported as its own 'raster'
+        event instead of with the next update
+        '''
+        result, elapsed = self._timed(name, fn, args)
+        if self.callback is not None:
+            self.callback('raster', {'stage': name, 'time': elapsed, 'update': self.updates})
+        return result
+
+    def _timed(self, name, fn, args):
+        if self.trackAllocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        if self.trackAllocations:
+            allocated = tracemalloc.get_traced_memory()[1] - before
+            self.stageAllocated[name] = self.stageAllocated.get(name, 0) + allocated
+        self.stageTime[name] = self.stageTime.get(name, 0.) + elapsed
+        self.stageCalls[name] = self.stageCalls.get(name, 0) + 1
+        return result, elapsed
+
+    def recordESS(self, ess):
+        self.ess = float(ess)
+        self.essMin = self.ess if self.essMin is None else min(self.essMin, self.ess)
+        self.essSum += self.ess
+
+    def recordResample(self):
+        self.resamples += 1
+        self._step['resampled'] = True
+
+    def recordReinitialize(self, belief):
+        self.reinitializations += 1
+        if self.callback is not None:
+            self.callback('reinitialize', {'belief': belief, 'update': self.updates})
+
+    def recordUpdate(self, nb_particles):
+        self.updates += 1
+        resampled = self._step.pop('resampled', False)
+        if self.callback is not None:
+            self.callback('update', {'stages': self._step, 'ess': self.ess, 'resampled': resampled, 'nb_particles': nb_particles})
+        self._step = {}
+
+    def summary(self):
+        '''
+        all counters as a plain dict, e.g. for logging or scraping
+        '''
+        return {
+            'updates': self.updates,
+            'resamples': self.resamples,
+            'resampleRate': self.resamples / self.updates if self.updates else None,
+            'reinitializations': self.reinitializations,
+            'ess': self.ess,
+            'essMin': self.essMin,
+            'essMean': self.essMean,
+            'stageTime': dict(self.stageTime),
+            'stageCalls': dict(self.stageCalls),
+            'stageMeanTime': {k: self.stageTime[k] / self.stageCalls[k] for k in self.stageTime},
+            'stageAllocated': dict(self.stageAllocated),
+        }
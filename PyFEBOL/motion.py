@@ -0,0 +1,169 @@
+'''
+motion.py
+
+Cedrick Argueta
+cdrckrgt@stanford.edu
+
+motion prediction for grid beliefs: the belief is convolved with the distribution
+of the target's displacement over one step
+'''
+import math
+
+import numpy as np
+
+from PyFEBOL import util
+
+DIRECT_TAPS = 25 # kernels with at most this many nonzero taps are applied directly
+
+_kernels = util.LRUCache(32) # (kind, radius in cells, nb_act_repeat) -> kernel
+_spectra = util.LRUCache(32) # (grid shape, kernel key) -> (padded shape, kernel spectrum)
+
+# the kernels move mass between cells, not points: the target is anywhere in its cell
+# before the step, and the mass that lands is summed over the cell it lands in. per
+# axis that's the displacement density convolved with two unit boxes, a triangle
+# max(0, 1 - |u|). so even a step much smaller than a cell leaks mass to the neighbors
+
+def diskKernel(radius, nb_act_repeat=1):
+    '''
+    cell to cell transfer kernel after nb_act_repeat steps, each uniform over a disk
+    of radius (in cells), as a normalized (2w + 1) x (2w + 1) array. the disk is
+    sampled on rings of equal area, and every sample is spread over the four cells
+    around it with bilinear (triangle) weights
+    '''
+    key = ('disk', radius, nb_act_repeat)
+    kernel = _kernels.get(key)
+    if kernel is None:
+        w = int(np.ceil(radius)) + 1
+        nb_rings = max(8, int(np.ceil(4. * radius)))
+        nb_angles = max(16, int(np.ceil(4. * np.pi * radius)))
+        r = radius * np.sqrt((np.arange(nb_rings) + 0.5) / nb_rings)
+        a = 2. * np.pi * (np.arange(nb_angles) + 0.5) / nb_angles
+        dx = (r[:, np.newaxis] * np.cos(a)).ravel() + w
+        dy = (r[:, np.newaxis] * np.sin(a)).ravel() + w
+        ix, iy = np.floor(dx).astype(int), np.floor(dy).astype(int)
+        fx, fy = dx - ix, dy - iy
+        side = 2 * w + 1
+        step = np.zeros(side * side)
+        for ox, wx in ((0, 1. - fx), (1, fx)):
+            for oy, wy in ((0, 1. - fy), (1, fy)):
+                step += np.bincount((iy + oy) * side + ix + ox, weights=wx * wy, minlength=side * side)
+        step = step.reshape(side, side)
+        # exactly symmetric, so the prediction doesn't drift the belief
+        step = step + step[::-1]
+        step = step + step[:, ::-1]
+        step = step + step.T
+        step /= step.sum()
+        kernel = step
+        for _ in range(nb_act_repeat - 1):
+            kernel = _fftConvolve(kernel, step)
+        kernel = kernel / kernel.sum()
+        assert radius <= 0. or kernel[kernel.shape[0] // 2, kernel.shape[1] // 2] < 1., 'motion kernel does not spread'
+        _kernels.put(key, kernel)
+    return kernel
+
+def _normalCdf(x):
+    return 0.5 * (1. + np.vectorize(math.erf)(x / np.sqrt(2.)))
+
+def gaussianTaps(sigma):
+    '''
+    1d cell to cell transfer taps for a gaussian displacement of std sigma (in cells):
+    the gaussian convolved with the triangle, out to 3 sigma + 1 cells, normalized
+    '''
+    key = ('gaussian', sigma)
+    taps = _kernels.get(key)
+    if taps is None:
+        w = int(np.ceil(3. * sigma)) + 1
+        x = np.arange(-w - 1, w + 2, dtype=float)
+        if sigma > 0.:
+            # twice integrated density, its second difference is the triangle average
+            g = x * _normalCdf(x / sigma) + sigma * np.exp(-0.5 * (x / sigma) ** 2) / np.sqrt(2. * np.pi)
+        else:
+            g = np.maximum(x, 0.)
+        taps = np.maximum(g[2:] - 2. * g[1:-1] + g[:-2], 0.)
+        taps /= taps.sum()
+        assert sigma <= 0. or taps[w] < 1., 'motion taps do not spread'
+        _kernels.put(key, taps)
+    return taps
+
+def _fastLength(n):
+    # smallest 2, 3, 5-smooth number >= n, those are the fast fft sizes
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+def _fftConvolve(a, b):
+    # full linear convolution of two 2d arrays
+    shape = (a.shape[0] + b.shape[0] - 1, a.shape[1] + b.shape[1] - 1)
+    padded = tuple(_fastLength(s) for s in shape)
+    full = np.fft.irfft2(np.fft.rfft2(a, padded) * np.fft.rfft2(b, padded), padded)
+    return np.maximum(full[:shape[0], :shape[1]], 0.)
+
+def _shiftAdd(out, belief, weight, di, dj):
+    # out[i + di, j + dj] += weight * belief[i, j], dropping what falls off the grid
+    rows, cols = belief.shape
+    src = (slice(max(0, -di), rows - max(0, di)), slice(max(0, -dj), cols - max(0, dj)))
+    dst = (slice(max(0, di), rows - max(0, -di)), slice(max(0, dj), cols - max(0, -dj)))
+    out[dst] += weight * belief[src]
+
+def convolve(belief, kernel, key=None):
+    '''
+    belief convolved with an odd-sized, centered kernel, same shape as belief.
+    zero padded: mass pushed past the edges is lost. small kernels are applied as
+    shifted sums, larger ones through the fft, with the kernel spectrum cached
+    under key (if given) for this grid shape
+    '''
+    wi, wj = kernel.shape[0] // 2, kernel.shape[1] // 2
+    taps = np.argwhere(kernel > 0)
+    if len(taps) <= DIRECT_TAPS:
+        out = np.zeros_like(belief)
+        for i, j in taps:
+            _shiftAdd(out, belief, kernel[i, j], i - wi, j - wj)
+        return out
+
+    cacheKey = (belief.shape, key)
+    entry = _spectra.get(cacheKey) if key is not None else None
+    if entry is None:
+        padded = tuple(_fastLength(s + k - 1) for s, k in zip(belief.shape, kernel.shape))
+        entry = (padded, np.fft.rfft2(kernel, padded))
+        if key is not None:
+            _spectra.put(cacheKey, entry)
+    padded, spectrum = entry
+    full = np.fft.irfft2(np.fft.rfft2(belief, padded) * spectrum, padded)
+    out = full[wi:wi + belief.shape[0], wj:wj + belief.shape[1]]
+    return np.maximum(out, 0.) # fft round-off can go slightly negative
+
+def convolveSeparable(belief, taps):
+    '''
+    belief convolved with taps along both axes, zero padded
+    '''
+    w = len(taps) // 2
+    tmp = np.zeros_like(belief)
+    for k, t in enumerate(taps):
+        _shiftAdd(tmp, belief, t, k - w, 0)
+    out = np.zeros_like(belief)
+    for k, t in enumerate(taps):
+        _shiftAdd(out, tmp, t, 0, k - w)
+    return out
+
+def predict(belief, cellSize, maxStep, kind='disk', nb_act_repeat=1):
+    '''
+    belief after the target moves nb_act_repeat steps of at most maxStep, in any
+    direction. kind is the displacement model for one step:
+        - 'disk': uniform over the disk of radius maxStep (through the fft for
+          large kernels)
+        - 'gaussian': a gaussian with the same variance per axis (maxStep / 2),
+          applied as two 1d convolutions
+    both go from cell to cell (see diskKernel), so steps shorter than a cell still
+    spread the belief
+    the result is not renormalized, mass that leaves the grid is dropped
+    '''
+    radius = maxStep / cellSize
+    if kind == 'gaussian':
+        return convolveSeparable(belief, gaussianTaps(0.5 * radius * np.sqrt(nb_act_repeat)))
+    assert kind == 'disk', 'unknown motion model {}'.format(kind)
+    return convolve(belief, diskKernel(radius, nb_act_repeat), ('disk', radius, nb_act_repeat))
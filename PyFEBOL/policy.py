@@ -6,8 +6,10 @@ cdrckrgt@stanford.edu
 
 policy stuff
 '''
+import copy
 import numpy as np
 import random
+import time
 from PyFEBOL import util
 
 class Policy(object):
@@ -37,6 +39,20 @@ class Policy(object):
         actions.append((0.0, 0.0, 0.0))
         return actions
 
+    def _planningSensor(self, sensor):
+        '''
+        a shallow copy of sensor for simulated observations and likelihoods: it draws
+        from the policy's rng, so planning doesn't consume the real observation noise,
+        and keeps its workspaces in the policy, so planning shapes don't make the
+        filter's workspaces reallocate
+        '''
+        sim = copy.copy(sensor)
+        if getattr(self, '_sensorWorkspace', None) is None:
+            self._sensorWorkspace = {}
+        sim._ws = self._sensorWorkspace
+        sim.rng = self.rng
+        return sim
+
 class MeanPolicy(Policy):
     def __init__(self, maxStep, numActions, headings=None):
         self.actions = self.makeActionList(maxStep, numActions, headings)
@@ -85,3 +101,208 @@ class ConstantVelocityPolicy(Policy):
             return action
         else:
             return np.array([action] * k)
+
+class InfoGainPolicy(Policy):
+    '''
+    picks the action whose next pose minimizes the expected entropy of the belief
+    after the next observation. all actions are scored at once:
+        - nb_particles particles are drawn from the filter by weight (and moved one
+          step by their velocity, if the filter has velocities)
+        - for each of nb_obs of them taken as the true target, an observation is
+          simulated from every candidate pose
+        - the subset is reweighted by the likelihood of every observation, giving
+          an [actions, observations, particles] array of posteriors whose entropies
+          are averaged over observations
+    more rounds of nb_obs observations are added until rounds is reached or another
+    round wouldn't fit in budget seconds, whichever is first (at least one round
+    always runs), so budget bounds the time per decision. the entropy is over the
+    particle subset, so f has to be a ParticleFilter. observations are simulated
+    from the policy's rng, not the sensor's (see Policy._planningSensor).
+    '''
+    def __init__(self, maxStep, numActions, headings=None, nb_particles=500, nb_obs=16, rounds=4, budget=None, rng=None):
+        self.actions = self.makeActionList(maxStep, numActions, headings)
+        self.actionArray = np.array(self.actions)
+        self.nb_particles = nb_particles
+        self.nb_obs = nb_obs
+        self.rounds = rounds
+        self.budget = budget
+        self.rng = util.getRNG(rng)
+        self.prob = None # likelihood workspace
+
+    def _subset(self, f):
+        idxs = self.rng.choice(f.nb_particles, self.nb_particles, p=f.weights / f.weights.sum())
+        x = f.x_particles[idxs] + f.dx_particles[idxs]
+        y = f.y_particles[idxs] + f.dy_particles[idxs]
+        return x, y
+
+    def expectedEntropy(self, domain, vehicle, f):
+        '''
+        expected posterior entropy of every action, in the order of self.actions
+        '''
+        start = time.perf_counter()
+        sensor = self._planningSensor(vehicle.sensor)
+        x, y = self._subset(f)
+        px, py, heading = vehicle.getNewPoses(self.actionArray)
+        np.clip(px, 0, domain.length, out=px) # like Drone.act
+        np.clip(py, 0, domain.length, out=py)
+        pose = (px[:, np.newaxis], py[:, np.newaxis], heading[:, np.newaxis]) # [actions, 1]
+        posePerObs = (pose[0][..., np.newaxis], pose[1][..., np.newaxis], pose[2][..., np.newaxis]) # [actions, 1, 1]
+
+        shape = (len(self.actions), self.nb_obs, self.nb_particles)
+        if self.prob is None or self.prob.shape != shape:
+            self.prob = np.empty(shape)
+        total = np.zeros(len(self.actions))
+        rounds = 0
+        while rounds < self.rounds:
+            # the same true targets for every action, so actions are compared on equal terms
+            true = self.rng.integers(self.nb_particles, size=self.nb_obs)
+            obs = sensor.observe((x[true], y[true]), pose) # [actions, observations]
+            p = sensor.prob((x, y), posePerObs, obs[..., np.newaxis], out=self.prob)
+            p += 1.e-300
+            p /= p.sum(axis=-1, keepdims=True)
+            total += -np.sum(p * np.log(p), axis=-1).sum(axis=-1)
+            rounds += 1
+            elapsed = time.perf_counter() - start
+            if self.budget is not None and elapsed * (rounds + 1) / rounds > self.budget:
+                break # the next round wouldn't finish in time
+        return total / (rounds * self.nb_obs)
+
+    def action(self, domain, vehicle, obs, f):
+        return self.actions[int(np.argmin(self.expectedEntropy(domain, vehicle, f)))]
+
+class _BeliefNode(object):
+    '''
+    belief node of the search tree: a weighted particle set and the drone pose
+    '''
+    def __init__(self, x, y, dx, dy, w, pose):
+        self.x, self.y, self.dx, self.dy, self.w = x, y, dx, dy, w
+        self.pose = pose
+        self.entropy = -np.sum(w * np.log(w))
+        self.visits = 0
+        self.actionVisits = None
+        self.actionValues = None
+        self.children = {} # (action index, observation bin) -> _BeliefNode
+
+class POMCPPolicy(Policy):
+    '''
+    anytime monte carlo tree search over beliefs (like POMCP, but every node keeps a
+    small weighted particle set, so any sensor with prob() works). the root belief
+    is nb_particles particles drawn from the filter by weight. one simulation:
+        - picks actions by UCB down the tree; every step moves the drone, moves the
+          particles by their velocity, simulates an observation from a particle drawn
+          by weight, and follows (or creates) the child for that observation's bin
+        - the reward of a step is the entropy the observation removes from the
+          particle weights
+        - from a new node, a random rollout runs to depth, every step vectorized
+          over the node's particles
+    simulations run until budget seconds have passed (or maxSimulations), then the
+    root action with the highest value is returned, so budget trades decision
+    quality for latency.
+
+    observations are binned to multiples of obsResolution, by default the sensor's
+    sigma if it has one (bearing only) and 1 otherwise (binary FOV observations).
+    f has to be a ParticleFilter.
+    '''
+    def __init__(self, maxStep, numActions, headings=None, budget=0.1, depth=5, nb_particles=200, discount=0.95, exploration=1., obsResolution=None, maxSimulations=None, rng=None):
+        self.actions = self.makeActionList(maxStep, numActions, headings)
+        self.actionArray = np.array(self.actions)
+        self.budget = budget
+        self.depth = depth
+        self.nb_particles = nb_particles
+        self.discount = discount
+        self.exploration = exploration
+        self.obsResolution = obsResolution
+        self.maxSimulations = maxSimulations
+        self.rng = util.getRNG(rng)
+
+    def action(self, domain, vehicle, obs, f):
+        start = time.perf_counter()
+        self.length = domain.length
+        self.headingMaxStep = vehicle.headingMaxStep
+        self.sensor = self._planningSensor(vehicle.sensor)
+        self.resolution = self.obsResolution or getattr(self.sensor, 'sigma', 1.)
+        self.prob = np.empty(self.nb_particles) # likelihood workspace
+
+        idxs = self.rng.choice(f.nb_particles, self.nb_particles, p=f.weights / f.weights.sum())
+        w = np.full(self.nb_particles, 1. / self.nb_particles)
+        root = _BeliefNode(f.x_particles[idxs], f.y_particles[idxs], f.dx_particles[idxs], f.dy_particles[idxs], w, vehicle.getPose())
+
+        self.simulations = 0
+        while True:
+            self._simulate(root, self.depth)
+            self.simulations += 1
+            if self.maxSimulations is not None and self.simulations >= self.maxSimulations:
+                break
+            if time.perf_counter() - start > self.budget:
+                break
+        values = np.where(root.actionVisits > 0, root.actionValues, -np.inf)
+        return self.actions[int(np.argmax(values))]
+
+    def _move(self, pose, a):
+        x, y, heading = pose
+        action = self.actions[a]
+        x = min(max(x + action[0], 0.), self.length) # like Drone.act
+        y = min(max(y + action[1], 0.), self.length)
+        return x, y, (heading + self.headingMaxStep * action[2]) % 360.
+
+    def _observe(self, x, y, w, pose):
+        '''
+        simulates an observation of a particle drawn by weight, returns it with the
+        reweighted (normalized) weights
+        '''
+        j = min(np.searchsorted(np.cumsum(w), self.rng.random()), len(w) - 1)
+        obs = self.sensor.observe((x[j], y[j]), pose)
+        p = self.sensor.prob((x, y), pose, obs, out=self.prob)
+        w = w * p
+        w += 1.e-300
+        w /= w.sum()
+        return obs, w
+
+    def _simulate(self, node, depth):
+        if depth == 0:
+            return 0.
+        if node.actionVisits is None:
+            node.actionVisits = np.zeros(len(self.actions))
+            node.actionValues = np.zeros(len(self.actions))
+
+        # ucb, unvisited actions first (in random order)
+        if node.visits < len(self.actions) and np.any(node.actionVisits == 0):
+            a = self.rng.choice(np.flatnonzero(node.actionVisits == 0))
+        else:
+            ucb = node.actionValues + self.exploration * np.sqrt(np.log(node.visits) / node.actionVisits)
+            a = int(np.argmax(ucb))
+
+        pose = self._move(node.pose, a)
+        x, y = node.x + node.dx, node.y + node.dy # target moves at constant velocity
+        obs, w = self._observe(x, y, node.w, pose)
+        key = (a, int(np.floor(obs / self.resolution)))
+        child = node.children.get(key)
+        if child is None:
+            child = node.children[key] = _BeliefNode(x, y, node.dx, node.dy, w, pose)
+            value = node.entropy - child.entropy + self.discount * self._rollout(child, depth - 1)
+        else:
+            value = node.entropy - child.entropy + self.discount * self._simulate(child, depth - 1)
+
+        node.visits += 1
+        node.actionVisits[a] += 1
+        node.actionValues[a] += (value - node.actionValues[a]) / node.actionVisits[a]
+        return value
+
+    def _rollout(self, node, depth):
+        '''
+        random actions to depth, every step vectorized over the node's particles
+        '''
+        value = 0.
+        factor = 1.
+        pose = node.pose
+        x, y, w = node.x, node.y, node.w
+        entropy = node.entropy
+        for a in self.rng.integers(len(self.actions), size=depth):
+            pose = self._move(pose, a)
+            x, y = x + node.dx, y + node.dy
+            _, w = self._observe(x, y, w, pose)
+            newEntropy = -np.sum(w * np.log(w))
+            value += factor * (entropy - newEntropy)
+            entropy = newEntropy
+            factor *= self.discount
+        return value
@@ -0,0 +1,195 @@
+'''
+recorder.py
+
+Cedrick Argueta
+cdrckrgt@stanford.edu
+
+recording episodes to disk, and reading them back for offline training
+'''
+import json
+import os
+
+import numpy as np
+
+from PyFEBOL import util
+
+class Recorder(object):
+    '''
+    streams one row per step into chunked, preallocated memory-mapped .npy files in
+    directory, one file per field and chunk (pose_00000.npy, ...). fields are:
+        - pose: [3] drone x, y, heading when the observation was made
+        - obs: the observation
+        - theta: [2] true target position
+        - action: [3] the action taken after the observation (nan if not given)
+        - cost: the cost of that action (nan if not given)
+        - episode, step: which episode, and which step of it, the row belongs to
+        - belief: the filter's belief ([1, buckets, buckets], float32), if belief is
+          True. written straight into the file through getBelief(out=...)
+    recording a loop like test.py takes a few lines:
+        with Recorder('data') as rec:
+            for episode in ...:
+                for step in ...:
+                    obs = ...; f.update(d.getPose(), obs); a = ...
+                    rec.record(d, m, f, obs, a, c.getCost(m, d, f, a))
+                    ...
+                rec.endEpisode()
+    note that record reads the drone pose and target position at the time of the
+    call, so call it before moving them. Replay reads the files back.
+    '''
+    def __init__(self, directory, chunkSize=100000, belief=True):
+        self.directory = directory
+        self.chunkSize = chunkSize
+        self.belief = belief
+        os.makedirs(directory, exist_ok=True)
+        self.fields = None # name -> (shape, dtype), fixed on the first record
+        self.chunks = {}
+        self.count = 0 # rows written
+        self.chunk = -1
+        self.episode = 0
+        self.step = 0
+        self.episodeStarts = [0]
+
+    def _fields(self, filter_):
+        fields = {
+            'pose': ((3,), np.float64),
+            'obs': ((), np.float64),
+            'theta': ((2,), np.float64),
+            'action': ((3,), np.float64),
+            'cost': ((), np.float64),
+            'episode': ((), np.int32),
+            'step': ((), np.int32),
+        }
+        if self.belief:
+            fields['belief'] = (np.shape(filter_.getBelief()), np.float32)
+        return fields
+
+    def _path(self, name, chunk):
+        return os.path.join(self.directory, '{}_{:05d}.npy'.format(name, chunk))
+
+    def _newChunk(self):
+        self.flush()
+        self.chunk += 1
+        self.chunks = {name: np.lib.format.open_memmap(self._path(name, self.chunk), mode='w+', dtype=dtype, shape=(self.chunkSize,) + shape)
+                       for name, (shape, dtype) in self.fields.items()}
+
+    def record(self, drone, domain, filter_, obs, action=None, cost=None):
+        if self.fields is None:
+            self.fields = self._fields(filter_)
+        row = self.count % self.chunkSize
+        if row == 0:
+            self._newChunk()
+        c = self.chunks
+        c['pose'][row] = drone.getPose()
+        c['obs'][row] = obs
+        c['theta'][row] = domain.getTheta()
+        c['action'][row] = np.nan if action is None else action
+        c['cost'][row] = np.nan if cost is None else cost
+        c['episode'][row] = self.episode
+        c['step'][row] = self.step
+        if self.belief:
+            filter_.getBelief(out=c['belief'][row])
+        self.count += 1
+        self.step += 1
+
+    def endEpisode(self):
+        if self.step == 0:
+            return
+        self.episode += 1
+        self.step = 0
+        self.episodeStarts.append(self.count)
+
+    def flush(self):
+        for m in self.chunks.values():
+            m.flush()
+        if self.fields is not None:
+            self._writeMeta()
+
+    def _writeMeta(self):
+        meta = {
+            'chunkSize': self.chunkSize,
+            'count': self.count,
+            'fields': {name: {'shape': list(shape), 'dtype': np.dtype(dtype).str} for name, (shape, dtype) in self.fields.items()},
+        }
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        starts = self.episodeStarts if self.episodeStarts[-1] == self.count else self.episodeStarts + [self.count]
+        np.save(os.path.join(self.directory, 'episodes.npy'), np.array(starts, dtype=np.int64))
+
+    def close(self):
+        self.endEpisode()
+        self.flush()
+        self.chunks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class Replay(object):
+    '''
+    reads a Recorder directory. chunks are memory-mapped, so only the rows that are
+    asked for are read from disk
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        self.chunkSize = meta['chunkSize']
+        self.count = meta['count']
+        self.fields = list(meta['fields'])
+        self.episodeStarts = np.load(os.path.join(directory, 'episodes.npy')) # last entry is count
+        nb_chunks = (self.count + self.chunkSize - 1) // self.chunkSize
+        self.chunks = {name: [np.load(os.path.join(directory, '{}_{:05d}.npy'.format(name, i)), mmap_mode='r') for i in range(nb_chunks)]
+                       for name in self.fields}
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nb_episodes(self):
+        return len(self.episodeStarts) - 1
+
+    def get(self, idxs, fields=None):
+        '''
+        rows idxs (global step indices) of the given fields (all by default), as arrays
+        '''
+        idxs = np.asarray(idxs, dtype=np.int64)
+        fields = self.fields if fields is None else fields
+        chunk, row = np.divmod(idxs, self.chunkSize)
+        batch = {}
+        for name in fields:
+            chunks = self.chunks[name]
+            out = np.empty((len(idxs),) + chunks[0].shape[1:], dtype=chunks[0].dtype)
+            for c in np.unique(chunk):
+                sel = chunk == c
+                out[sel] = chunks[c][row[sel]]
+            batch[name] = out
+        return batch
+
+    def sample(self, batchSize, fields=None, rng=None, withNext=False):
+        '''
+        a random minibatch of steps. rng is a Generator or seed (see util.getRNG).
+        with withNext, only steps that have a following step in the same episode are
+        drawn, and that step's fields are added as 'next_<field>'
+        '''
+        rng = util.getRNG(rng)
+        if not withNext:
+            idxs = np.sort(rng.integers(self.count, size=batchSize)) # sorted reads are friendlier to the page cache
+            return self.get(idxs, fields)
+        # a step has a successor unless it's the last of its episode
+        lengths = np.diff(self.episodeStarts)
+        valid = np.maximum(lengths - 1, 0)
+        draws = np.sort(rng.integers(valid.sum(), size=batchSize))
+        episode = np.searchsorted(np.cumsum(valid), draws, side='right')
+        idxs = self.episodeStarts[episode] + draws - (np.cumsum(valid) - valid)[episode]
+        batch = self.get(idxs, fields)
+        for name, value in self.get(idxs + 1, fields).items():
+            batch['next_' + name] = value
+        return batch
+
+    def getEpisode(self, episode, fields=None):
+        '''
+        every step of one episode
+        '''
+        return self.get(np.arange(self.episodeStarts[episode], self.episodeStarts[episode + 1]), fields)
@@ -0,0 +1,154 @@
+'''
+resample.py
+
+Cedrick Argueta
+cdrckrgt@stanford.edu
+
+resampling schemes for particle filters
+'''
+import numpy as np
+from PyFEBOL import util
+
+def ess(weights):
+    '''
+    effective sample size of normalized weights, taken over the last axis
+    '''
+    return 1. / np.sum(np.square(weights), axis=-1)
+
+def _searchsorted(cumsum, positions):
+    '''
+    row-wise searchsorted. weights may be [n] or [rows, n]: each row is shifted
+    by its row number so one searchsorted call covers all rows.
+    returns the index of the first cumsum entry greater than each position
+    '''
+    if cumsum.ndim == 1:
+        idxs = np.searchsorted(cumsum, positions, side='right')
+        return np.minimum(idxs, len(cumsum) - 1) # floating point can push the last position past the end
+    rows, n = cumsum.shape
+    offsets = np.arange(rows)[:, np.newaxis]
+    idxs = np.searchsorted((cumsum + offsets).ravel(), (positions + offsets).ravel(), side='right')
+    idxs = idxs.reshape(positions.shape) - offsets * n
+    return np.clip(idxs, 0, n - 1)
+
+def _cumsum(weights):
+    cumsum = np.cumsum(weights, axis=-1)
+    cumsum /= cumsum[..., -1:]
+    return cumsum
+
+def _sortedUniforms(shape, rng):
+    '''
+    sorted uniform draws in O(n), from normalized sums of exponentials.
+    searchsorted is much faster on sorted positions than on scattered ones
+    '''
+    spacings = rng.standard_exponential(shape[:-1] + (shape[-1] + 1,))
+    cumsum = np.cumsum(spacings, axis=-1)
+    return cumsum[..., :-1] / cumsum[..., -1:]
+
+class Resampler(object):
+    '''
+    base class for resampling schemes.
+
+    resample(weights) returns the indices of the particles to keep. weights can be
+    [nb_particles] or [rows, nb_particles], in which case every row is resampled
+    independently. nb_samples changes how many indices are drawn per row (the
+    adaptive particle filter uses this to grow or shrink), it defaults to nb_particles.
+
+    ess_threshold is the fraction of particles the effective sample size has to fall
+    below before the filter resamples. rng is a numpy Generator or seed (see util.getRNG).
+    '''
+    def __init__(self, ess_threshold=0.5, rng=None):
+        self.ess_threshold = ess_threshold
+        self.rng = util.getRNG(rng)
+
+    def needsResample(self, weights):
+        '''
+        bool (or bool per row) whether the effective sample size is below the threshold
+        '''
+        return ess(weights) < self.ess_threshold * weights.shape[-1]
+
+    def resample(self, weights, nb_samples=None):
+        raise Exception("please instantiate a specific resampler, this is just a base class!")
+
+class StratifiedResampler(Resampler):
+    '''
+    one uniform draw in each of n equal subdivisions of [0, 1)
+    '''
+    def resample(self, weights, nb_samples=None):
+        n = nb_samples or weights.shape[-1]
+        positions = (self.rng.random(weights.shape[:-1] + (n,)) + np.arange(n)) / n
+        return _searchsorted(_cumsum(weights), positions)
+
+class SystematicResampler(Resampler):
+    '''
+    like stratified, but the same offset is used in every subdivision
+    '''
+    def resample(self, weights, nb_samples=None):
+        n = nb_samples or weights.shape[-1]
+        positions = (self.rng.random(weights.shape[:-1] + (1,)) + np.arange(n)) / n
+        return _searchsorted(_cumsum(weights), positions)
+
+class MultinomialResampler(Resampler):
+    '''
+    n independent draws from the weights
+    '''
+    def resample(self, weights, nb_samples=None):
+        n = nb_samples or weights.shape[-1]
+        return _searchsorted(_cumsum(weights), _sortedUniforms(weights.shape[:-1] + (n,), self.rng))
+
+class ResidualResampler(Resampler):
+    '''
+    floor(n * w) copies of every particle, the remainder drawn multinomially from
+    the leftover weight
+    '''
+    def resample(self, weights, nb_samples=None):
+        m = weights.shape[-1]
+        n = nb_samples or m
+        w = np.atleast_2d(weights)
+        rows = w.shape[0]
+
+        scaled = w * (n / w.sum(axis=1, keepdims=True))
+        counts = np.floor(scaled)
+        residual = scaled - counts
+        nb_residual = n - counts.sum(axis=1).astype(int)
+
+        # nb_residual sorted uniforms per row: S_i / S_(k+1) for partial sums S of
+        # exponentials, positions past the first nb_residual are thrown away
+        residual += 1.e-300
+        spacings = np.cumsum(self.rng.standard_exponential((rows, n + 1)), axis=1)
+        positions = spacings[:, :n] / spacings[np.arange(rows), nb_residual][:, np.newaxis]
+        extra = _searchsorted(_cumsum(residual), positions)
+        keep = np.arange(n) < nb_residual[:, np.newaxis]
+        extra = (extra + np.arange(rows)[:, np.newaxis] * m)[keep]
+        counts = counts.astype(int).ravel() + np.bincount(extra, minlength=rows * m)
+
+        idxs = np.repeat(np.arange(rows * m), counts).reshape(rows, n) - np.arange(rows)[:, np.newaxis] * m
+        return idxs.reshape(weights.shape[:-1] + (n,))
+
+class KLDSampler(object):
+    '''
+    KLD-sampling (fox, 2003): picks the number of particles so that, with probability
+    1 - delta, the KL divergence between the particle approximation and the true
+    posterior stays below epsilon. the bound only depends on k, the number of
+    histogram bins the posterior occupies, so a collapsed belief needs few particles.
+
+    the filter only resizes when the bound moves more than tolerance * nb_particles
+    away from the current count, so small fluctuations don't force a resample.
+    '''
+    def __init__(self, epsilon=0.05, delta=0.01, minParticles=500, maxParticles=100000, tolerance=0.1):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.minParticles = minParticles
+        self.maxParticles = maxParticles
+        self.tolerance = tolerance
+        from statistics import NormalDist # only needed here, kept out of the import of the module
+        self.z = NormalDist().inv_cdf(1. - delta) # upper 1 - delta quantile of the standard normal
+
+    def nbParticles(self, k):
+        if k <= 1:
+            return self.minParticles
+        a = 2. / (9. * (k - 1))
+        n = (k - 1) / (2. * self.epsilon) * (1. - a + np.sqrt(a) * self.z) ** 3
+        return int(np.clip(np.ceil(n), self.minParticles, self.maxParticles))
+
+    def needsResize(self, nb_particles, n):
+        return abs(n - nb_particles) > self.tolerance * nb_particles
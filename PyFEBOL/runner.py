@@ -0,0 +1,305 @@
+'''
+runner.py
+
+Cedrick Argueta
+cdrckrgt@stanford.edu
+
+monte carlo evaluation: many seeded episodes of a scenario over a process pool
+'''
+import functools
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from PyFEBOL import util
+from PyFEBOL.drone import Drone
+from PyFEBOL.filter import DiscreteFilter, ExtendedKalmanFilter, ParticleFilter
+from PyFEBOL.searchdomain import SearchDomain
+
+class Scenario(object):
+    '''
+    everything needed to run one episode, the same loop as test.py:
+    observe, update the filter, pick an action, act, move the target, add up the cost.
+
+    components are given as factories, not objects, so every worker process can build
+    its own. they have to be picklable: classes, module-level functions or
+    functools.partial of those.
+        - sensor(rng=...) -> Sensor, e.g. functools.partial(BearingOnlySensor, 10.)
+        - filter(domain, drone, rng) -> Filter, see particleFilter and discreteFilter
+        - policy() -> Policy with action(domain, drone, obs, filter)
+        - cost() -> CostModel
+        - target() -> target policy for the SearchDomain, or None for a static target
+
+    drone is (x, y, heading, maxStep, headingMaxStep) at the start of every episode,
+    init the target start as a fraction of length (random if None, see SearchDomain).
+    an episode runs maxSteps steps. the target counts as localized once the filter's
+    centroid is within localizeDistance of it.
+    '''
+    def __init__(self, sensor, filter, policy, cost, length=200., maxSteps=100, drone=(25., 25., 60., 2.0, 15.0), target=None, init=None, localizeDistance=15., nb_act_repeat=1):
+        self.sensor = sensor
+        self.filter = filter
+        self.policy = policy
+        self.cost = cost
+        self.length = length
+        self.maxSteps = maxSteps
+        self.drone = drone
+        self.target = target
+        self.init = init
+        self.localizeDistance = localizeDistance
+        self.nb_act_repeat = nb_act_repeat
+
+def _particleFilter(buckets, nb_particles, domain, drone, rng, **kwargs):
+    return ParticleFilter(domain, buckets, drone.sensor, drone.maxStep, nb_particles, rng=rng, **kwargs)
+
+def _discreteFilter(cls, buckets, domain, drone, rng, **kwargs):
+    return cls(domain, buckets, drone.sensor, **kwargs)
+
+def _gaussianFilter(cls, buckets, domain, drone, rng, **kwargs):
+    return cls(domain, buckets, drone.sensor, drone.maxStep, rng=rng, **kwargs)
+
+def particleFilter(buckets, nb_particles, **kwargs):
+    '''
+    filter factory for a Scenario. kwargs go to ParticleFilter. with a pool
+    (poolSize), also give a poolSeed so that results don't depend on which worker
+    built the pool
+    '''
+    return functools.partial(_particleFilter, buckets, nb_particles, **kwargs)
+
+def discreteFilter(buckets, cls=DiscreteFilter, **kwargs):
+    '''
+    filter factory for a Scenario, cls can be any DiscreteFilter subclass
+    '''
+    return functools.partial(_discreteFilter, cls, buckets, **kwargs)
+
+def gaussianFilter(buckets, cls=ExtendedKalmanFilter, **kwargs):
+    '''
+    filter factory for a Scenario, cls is ExtendedKalmanFilter or UnscentedKalmanFilter
+    '''
+    return functools.partial(_gaussianFilter, cls, buckets, **kwargs)
+
+class Worker(object):
+    '''
+    runs episodes of one scenario. the sensor, policy, cost model and filter are built
+    once and reused for every episode (the filter through reset), only the domain and
+    drone are rebuilt per episode. the sensor, filter and policy (if it has an rng)
+    get new generators every episode
+    '''
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.sensor = scenario.sensor(rng=0)
+        self.policy = scenario.policy()
+        self.cost = scenario.cost()
+        self.filter = None
+
+    def episode(self, seed, episode):
+        '''
+        runs one episode, returns (cost, steps to localize or -1, final tracking error).
+        the result only depends on (seed, episode), not on which worker runs it
+        '''
+        sc = self.scenario
+        ss = np.random.SeedSequence([seed, episode])
+        domainRNG, sensorRNG, filterRNG, policyRNG = [np.random.Generator(np.random.SFC64(s)) for s in ss.spawn(4)]
+        # for components that still use the global generators (target and seeker policies)
+        state = int(ss.generate_state(1)[0])
+        np.random.seed(state)
+        random.seed(state)
+
+        self.sensor.rng = sensorRNG
+        if hasattr(self.policy, 'rng'):
+            self.policy.rng = policyRNG
+        domain = SearchDomain(sc.length, policy=sc.target() if sc.target is not None else None, init=sc.init, rng=domainRNG)
+        drone = Drone(*sc.drone, self.sensor, domain)
+        if self.filter is None:
+            self.filter = sc.filter(domain, drone, 0) # reset below swaps in the episode's generator
+        f = self.filter
+        f.domain = domain
+        f.reset(filterRNG) # also on the first episode, so every episode starts the same way
+
+        cost = 0.
+        localized = -1
+        localize2 = sc.localizeDistance ** 2
+        for step in range(sc.maxSteps):
+            obs = drone.observe(domain)
+            f.update(drone.getPose(), obs, sc.nb_act_repeat)
+            if localized < 0 and util.getDistance2(f.centroid(), domain.getTheta()) < localize2:
+                localized = step + 1
+
+            a = self.policy.action(domain, drone, obs, f)
+            drone.act(a, sc.nb_act_repeat)
+            domain.moveTarget(sc.nb_act_repeat)
+            cost += self.cost.getCost(domain, drone, f, a)
+
+        error = np.sqrt(util.getDistance2(f.centroid(), domain.getTheta()))
+        return cost, localized, error
+
+    def run(self, seed, episodes):
+        '''
+        runs the given episodes, returns their metrics as arrays
+        '''
+        results = np.array([self.episode(seed, e) for e in episodes]).reshape(-1, 3)
+        return {
+            'episode': np.asarray(episodes, dtype=np.int64),
+            'cost': results[:, 0],
+            'stepsToLocalize': results[:, 1].astype(np.int32),
+            'trackingError': results[:, 2],
+        }
+
+_worker = None # one Worker per pool process
+
+def _initWorker(scenario):
+    global _worker
+    _worker = Worker(scenario)
+
+def _runChunk(seed, episodes):
+    return _worker.run(seed, episodes)
+
+class RunningStats(object):
+    '''
+    count, mean, std, min and max, updated a batch at a time (chan et al.)
+    '''
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        n = len(values)
+        if n == 0:
+            return
+        mean = values.mean()
+        m2 = np.sum((values - mean) ** 2)
+        delta = mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.
+
+    def summary(self):
+        return {'count': self.count, 'mean': float(self.mean), 'std': float(self.std), 'min': float(self.min), 'max': float(self.max)}
+
+class Results(object):
+    '''
+    metrics of a run, aggregated as chunks of episodes come back.
+    stepsToLocalize only counts episodes that localized the target, localized is
+    the fraction that did
+    '''
+    def __init__(self, keepEpisodes=True):
+        self.keepEpisodes = keepEpisodes
+        self.cost = RunningStats()
+        self.stepsToLocalize = RunningStats()
+        self.trackingError = RunningStats()
+        self.episodes = 0
+        self.nb_localized = 0
+        self.chunks = []
+
+    def add(self, chunk):
+        self.episodes += len(chunk['episode'])
+        self.cost.add(chunk['cost'])
+        self.trackingError.add(chunk['trackingError'])
+        steps = chunk['stepsToLocalize']
+        self.stepsToLocalize.add(steps[steps >= 0])
+        self.nb_localized += int(np.count_nonzero(steps >= 0))
+        if self.keepEpisodes:
+            self.chunks.append(chunk)
+
+    @property
+    def localized(self):
+        return self.nb_localized / self.episodes if self.episodes else None
+
+    def arrays(self):
+        '''
+        per-episode metrics of every episode so far, sorted by episode
+        '''
+        assert self.keepEpisodes, 'episodes were not kept'
+        if not self.chunks:
+            return {}
+        merged = {k: np.concatenate([c[k] for c in self.chunks]) for k in self.chunks[0]}
+        order = np.argsort(merged['episode'])
+        return {k: v[order] for k, v in merged.items()}
+
+    def summary(self):
+        return {
+            'episodes': self.episodes,
+            'localized': self.localized,
+            'cost': self.cost.summary(),
+            'stepsToLocalize': self.stepsToLocalize.summary(),
+            'trackingError': self.trackingError.summary(),
+        }
+
+def run(scenario, nb_episodes, seed=0, workers=None, chunksize=None, callback=None, keepEpisodes=True):
+    '''
+    runs episodes 0 .. nb_episodes - 1 of scenario. episode e always uses the same
+    random streams, derived from (seed, e), so results don't depend on the number
+    of workers or how episodes are split between them.
+
+    workers is the number of processes (os.cpu_count() if None, 0 runs everything in
+    this process). episodes are sent out in chunks of chunksize, callback(results) is
+    called after every chunk that comes back.
+    '''
+    workers = os.cpu_count() if workers is None else workers
+    if chunksize is None:
+        chunksize = max(1, min(64, nb_episodes // (4 * max(workers, 1))))
+    chunks = [list(range(i, min(i + chunksize, nb_episodes))) for i in range(0, nb_episodes, chunksize)]
+    results = Results(keepEpisodes)
+
+    if workers == 0:
+        worker = Worker(scenario)
+        for episodes in chunks:
+            results.add(worker.run(seed, episodes))
+            if callback is not None:
+                callback(results)
+        return results
+
+    with ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(scenario,)) as pool:
+        futures = [pool.submit(_runChunk, seed, episodes) for episodes in chunks]
+        for future in as_completed(futures):
+            results.add(future.result())
+            if callback is not None:
+                callback(results)
+    return results
+
+def _progress(results, nb_episodes, start):
+    sys.stdout.write('\r{}/{} episodes, {:.1f}s, mean cost {:.3f}, localized {:.2f}'.format(
+        results.episodes, nb_episodes, time.time() - start, results.cost.mean, results.localized))
+    sys.stdout.flush()
+
+if __name__ == '__main__':
+    import argparse
+    from PyFEBOL.cost import MaxEigenvalDistanceCostModel
+    from PyFEBOL.policy import MeanPolicy, ConstantVelocityPolicy
+    from PyFEBOL.sensor import BearingOnlySensor
+
+    parser = argparse.ArgumentParser(description='monte carlo run of the test.py scenario')
+    parser.add_argument('--episodes', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--particles', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    scenario = Scenario(
+        sensor=functools.partial(BearingOnlySensor, 10.),
+        filter=particleFilter(64, args.particles),
+        policy=functools.partial(MeanPolicy, 2.0, 36),
+        cost=functools.partial(MaxEigenvalDistanceCostModel, 0.1, 15.),
+        target=functools.partial(ConstantVelocityPolicy, 1.0, -0.5),
+        maxSteps=args.steps,
+    )
+    start = time.time()
+    results = run(scenario, args.episodes, args.seed, args.workers, callback=lambda r: _progress(r, args.episodes, start))
+    print()
+    for k, v in results.summary().items():
+        print(k, v)
@@ -8,10 +8,12 @@ the area in which the drone moves
 '''
 import numpy as np
 import random
+from PyFEBOL import util
 
 class SearchDomain(object):
-    def __init__(self, length, policy=None, init=None):
+    def __init__(self, length, policy=None, init=None, rng=None):
         self.length = length
+        self.rng = util.getRNG(rng)
 
         # if an init was passed. just start the target there
         # otherwise we pick a random corner to start in
@@ -19,7 +21,7 @@ class SearchDomain(object):
         if init: # fix position of target
             self.theta = (init[0] * self.length, init[1] * self.length)
         else:
-            self.theta = (np.random.rand() * self.length, np.random.rand() * self.length)  # random RF source location
+            self.theta = (self.rng.random() * self.length, self.rng.random() * self.length)  # random RF source location
         self.policy = policy
 
     def moveTarget(self, nb_act_repeat=1):
@@ -38,6 +40,14 @@ class SearchDomain(object):
     def getTheta(self):
         return self.theta
 
+    def getState(self):
+        # the target policy is not saved, it's assumed to be rebuilt the same way
+        return {'theta': np.array(self.theta, dtype=float), 'rng': util.rngState(self.rng)}
+
+    def setState(self, state):
+        self.theta = tuple(float(v) for v in state['theta'])
+        util.setRNGState(self.rng, state['rng'])
+
 
 if __name__ == '__main__':
     sd = SearchDomain(100)
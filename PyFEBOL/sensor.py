@@ -7,86 +7,179 @@ cdrckrgt@stanford.edu
 sensor stuff
 '''
 import numpy as np
-from scipy.stats import norm
 from PyFEBOL import util
 
 class Sensor(object):
     def __init__(self):
         raise Exception("please instantiate a specific sensor, this is just a base class!")
-    
+
     def observe(self):
         raise Exception("please instantiate a specific sensor, this is just a base class!")
 
+    def getState(self):
+        return {'rng': util.rngState(self.rng)}
+
+    def setState(self, state):
+        util.setRNGState(self.rng, state['rng'])
+
+    def _workspace(self, name, shape, n=1, dtype=float):
+        '''
+        n scratch arrays of the given shape, kept between calls so that
+        repeated calls on the same number of particles don't allocate
+        '''
+        if getattr(self, '_ws', None) is None:
+            self._ws = {}
+        ws = self._ws.get(name)
+        if ws is None or ws.shape[1:] != shape or ws.shape[0] < n:
+            ws = self._ws[name] = np.empty((n,) + shape, dtype=dtype)
+        return [ws[i, ...] for i in range(n)] # ellipsis keeps 0-d arrays as arrays
+
+    def _geometry(self, theta, pose, shape):
+        '''
+        true bearing and squared distance from pose to theta, in workspace arrays
+        '''
+        bearing, distance2, scratch = self._workspace('geometry', shape, 3)
+        _bearing(theta, pose, bearing, scratch)
+        _distance2(theta, pose, distance2, scratch)
+        return bearing, distance2
+
+    def _shape(self, theta, pose, obs=None):
+        return np.broadcast_shapes(np.shape(theta[0]), np.shape(theta[1]), np.shape(pose[0]), np.shape(pose[1]), np.shape(pose[2]), np.shape(obs))
+
+def _bearing(theta, pose, out, work):
+    '''
+    writes the true bearing from pose to theta into out, in degrees in (-180, 180].
+    same as util.getTrueBearing up to a multiple of 360, without temporaries
+    '''
+    np.subtract(theta[0], pose[0], out=work)
+    np.subtract(theta[1], pose[1], out=out)
+    np.arctan2(out, work, out=out)
+    np.multiply(out, 180. / np.pi, out=out)
+    return out
+
+def _distance2(theta, pose, out, work):
+    '''
+    writes the squared distance from pose to theta into out
+    '''
+    np.subtract(theta[0], pose[0], out=work)
+    np.square(work, out=work)
+    np.subtract(theta[1], pose[1], out=out)
+    np.square(out, out=out)
+    np.add(out, work, out=out)
+    return out
+
+def _wrap180(angle, work):
+    '''
+    wraps angle into [-180, 180] in place. np.mod is several times slower than this
+    '''
+    np.multiply(angle, 1. / 360., out=work)
+    np.rint(work, out=work)
+    np.multiply(work, 360., out=work)
+    np.subtract(angle, work, out=angle)
+    return angle
+
+def _result(out):
+    return out[()] if out.ndim == 0 else out # scalar in, scalar out
+
 class BearingOnlySensor(Sensor):
-    def __init__(self, sigma):
+    def __init__(self, sigma, rng=None):
         self.sigma = sigma # std dev for noise in observations
+        self.rng = util.getRNG(rng)
 
     def observe(self, theta, pose):
+        # theta and pose may be arrays, giving one independent observation per element
         truth = util.getTrueBearing(theta, pose)
-        noise = self.sigma * np.random.randn()
+        noise = self.sigma * self.rng.standard_normal(np.shape(truth))
         return (truth + noise) % 360.
- 
-    def prob(self, theta, pose, obs):
-        bearing = util.getTrueBearing(theta, pose)
-        obsDiff = util.fit180(obs - bearing)
-        return norm._pdf(obsDiff / self.sigma) / self.sigma # abandon error checking in name of performance
+
+    def prob(self, theta, pose, obs, out=None):
+        '''
+        gaussian likelihood of obs for targets at theta. every step is done in place in
+        out (allocated if None), so passing the same out every call allocates nothing
+        '''
+        shape = self._shape(theta, pose, obs)
+        if out is None:
+            out = np.empty(shape)
+        work, = self._workspace('bearing', shape)
+        _bearing(theta, pose, out, work)
+        return self.likelihood(out, None, pose, obs, out)
+
+    def likelihood(self, bearing, distance2, pose, obs, out=None):
+        '''
+        prob, but from precomputed true bearings (degrees, any multiple of 360) to the
+        targets. distance2 is unused, it's there so all sensors share the signature.
+        out may be bearing itself
+        '''
+        if out is None:
+            out = np.empty(np.broadcast_shapes(np.shape(bearing), np.shape(obs)))
+        work, = self._workspace('likelihood', out.shape)
+        np.subtract(obs, bearing, out=out)
+        _wrap180(out, work)
+        np.square(out, out=out)
+        np.multiply(out, -0.5 / self.sigma ** 2, out=out)
+        np.exp(out, out=out)
+        np.multiply(out, 1. / (np.sqrt(2. * np.pi) * self.sigma), out=out)
+        return _result(out)
 
 class FOVSensor(Sensor):
     # requires headings to be input if you want something good...
-    def __init__(self, alpha, cone_width, blind_distance):
+    def __init__(self, alpha, cone_width, blind_distance, rng=None):
         self.alpha = alpha
         self.cone_width = cone_width
         self.a1 = self.cone_width / 2.
         self.a2 = 180. - self.a1
         self.blind_distance = blind_distance
+        self.rng = util.getRNG(rng)
+
+    def likelihood(self, bearing, distance2, pose, obs, out=None):
+        '''
+        prob, but from precomputed true bearings (degrees, any multiple of 360) and
+        squared distances to the targets. bearing and distance2 are not modified.
+        the probability of seeing the target (obs == 1) is:
+            1 - alpha if the target is within a1 of the heading (front cone),
+            alpha if it is more than a2 away (back cone),
+            0.5 in between, or if closer than blind_distance
+        (see dressel pseudobearing sensor paper)
+        '''
+        if out is None:
+            out = np.empty(np.broadcast_shapes(np.shape(bearing), np.shape(pose[2]), np.shape(obs)))
+        work, = self._workspace('likelihood', out.shape)
+        front, back = self._workspace('masks', out.shape, 2, dtype=bool)
+
+        # absolute bearing relative to heading
+        np.subtract(pose[2], bearing, out=out)
+        _wrap180(out, work)
+        np.absolute(out, out=out)
+        np.less(out, self.a1, out=front)
+        np.greater_equal(out, self.a2, out=back)
+
+        # +1 in the front cone, -1 in the back cone, 0 elsewhere or if we're too close to see
+        np.subtract(front, back, out=out, dtype=out.dtype)
+        np.greater_equal(distance2, self.blind_distance ** 2, out=front)
+        np.multiply(out, front, out=out)
 
-    def _getProb(self, bearing):
-        if bearing < self.a1:
-            return 1.0 - self.alpha
-        elif bearing < self.a2:
-            return 0.5
-        else:
-            return self.alpha
+        # 0.5 +- (0.5 - alpha), mirrored when the target wasn't seen.
+        # arithmetic on the masks is much faster than masked assignment
+        sign = np.where(np.asarray(obs) == 1, 1., -1.)
+        np.multiply(out, sign * (0.5 - self.alpha), out=out)
+        np.add(out, 0.5, out=out)
+        return _result(out)
+
+    def _probInView(self, theta, pose):
+        shape = self._shape(theta, pose)
+        bearing, distance2 = self._geometry(theta, pose, shape)
+        return self.likelihood(bearing, distance2, pose, 1, np.empty(shape))
 
     def observe(self, theta, pose):
-        truth = util.getTrueBearing(theta, pose)
-        rel_bearing = np.absolute(util.fit180(pose[2] - truth))
-
-        if type(rel_bearing) == np.ndarray:
-            prob_in_view = np.vectorize(self._getProb)(rel_bearing)
-            distance = util.getDistance2(pose, theta)
-            prob_in_view[np.where(distance < self.blind_distance ** 2)] = 0.5
-            obs = np.asarray(np.random.random(len(rel_bearing)) < prob_in_view).nonzero()
-            assert np.all(np.isfinite(obs)), 'obs contains nan values. obs: {}'.format(obs)
-            return obs
-        else:
-            prob_in_view = self._getProb(rel_bearing)
-            distance = util.getDistance2(pose, theta)
-            # too close, then we're blind (see dressel pseudobearing sensor paper)
-            if distance < self.blind_distance ** 2:
-                prob_in_view = 0.5
-            obs = 1 if np.random.random() < prob_in_view else 0
-            return obs
-
-    def prob(self, theta, pose, obs):
-        truth = util.getTrueBearing(theta, pose)
-        rel_bearing = np.absolute(util.fit180(pose[2] - truth))
-
-        if type(rel_bearing) == np.ndarray:
-            prob_in_view = np.vectorize(self._getProb)(rel_bearing)
-            distance = util.getDistance2(pose, theta)
-            prob_in_view[np.asarray(distance < self.blind_distance ** 2).nonzero()] = 0.5
-            prob = np.where(obs == 1, prob_in_view, (1.0 - prob_in_view))
-            assert np.all(np.isfinite(prob)), 'prob contains nan values. prob: {}'.format(prob)
-            return prob
-        else:
-            prob_in_view = self._getProb(rel_bearing)
-            distance = util.getDistance2(pose, theta)
-            if distance < self.blind_distance ** 2:
-                prob_in_view = 0.5
-            if obs == 1:
-                return prob_in_view
-            else:
-                return 1.0 - prob_in_view
-
-        
+        prob_in_view = self._probInView(theta, pose)
+        if np.ndim(prob_in_view) == 0:
+            return 1 if self.rng.random() < prob_in_view else 0
+        return (self.rng.random(prob_in_view.shape) < prob_in_view).astype(int)
+
+    def prob(self, theta, pose, obs, out=None):
+        '''
+        likelihood of the binary obs for targets at theta, computed in out (allocated if None)
+        '''
+        shape = self._shape(theta, pose, obs)
+        bearing, distance2 = self._geometry(theta, pose, shape)
+        return self.likelihood(bearing, distance2, pose, obs, np.empty(shape) if out is None else out)
@@ -0,0 +1,76 @@
+'''
+spatial.py
+
+Cedrick Argueta
+cdrckrgt@stanford.edu
+
+spatial index over particles
+'''
+import numpy as np
+
+class ParticleGrid(object):
+    '''
+    uniform bucket grid over the search domain. particles are sorted by bucket
+    (row-major), so the particles in a run of buckets along one row are one
+    contiguous slice. a disc query only looks at the slices of the rows its
+    bounding box covers, not at every particle.
+
+    particles outside the domain are put in the nearest edge bucket, distances
+    are always checked exactly.
+
+    building is a counting sort: with at most 2^16 buckets the bucket ids fit in
+    uint16, and numpy's stable sort of those is a linear time radix sort.
+    '''
+    def __init__(self, length, cellSize):
+        self.length = length
+        self.cellSize = cellSize
+        self.side = int(np.ceil(length / cellSize)) # buckets per side
+
+    def build(self, x, y, weights):
+        cx = self._bucket(x)
+        cy = self._bucket(y)
+        cells = cy * self.side + cx
+        if self.side ** 2 <= 1 << 16:
+            cells = cells.astype(np.uint16)
+        order = np.argsort(cells, kind='stable')
+        self.x = x[order]
+        self.y = y[order]
+        self.weights = weights[order]
+        self.totalWeight = weights.sum()
+        counts = np.bincount(cells, minlength=self.side ** 2)
+        self.starts = np.concatenate(([0], np.cumsum(counts)))
+        return self
+
+    def _bucket(self, v):
+        return np.clip((np.asarray(v) / self.cellSize).astype(int), 0, self.side - 1)
+
+    def fractionWithin(self, px, py, r, weighted=True):
+        '''
+        fraction of particles within r of each point (px, py), by weight or by count.
+        px, py can be scalars or arrays of query points
+        '''
+        scalar = np.ndim(px) == 0
+        px = np.atleast_1d(np.asarray(px, dtype=float))
+        py = np.atleast_1d(np.asarray(py, dtype=float))
+        nb_queries = len(px)
+
+        # bucket rows covered by each query's bounding box
+        cx0, cx1 = self._bucket(px - r), self._bucket(px + r)
+        cy0, cy1 = self._bucket(py - r), self._bucket(py + r)
+        nb_rows = cy1 - cy0 + 1
+        query = np.repeat(np.arange(nb_queries), nb_rows)
+        row = cy0[query] + np.arange(len(query)) - np.repeat(np.cumsum(nb_rows) - nb_rows, nb_rows)
+
+        # each row is one slice of the sorted particles, gather all of them at once
+        lo = self.starts[row * self.side + cx0[query]]
+        hi = self.starts[row * self.side + cx1[query] + 1]
+        lengths = hi - lo
+        idxs = np.repeat(lo - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        query = np.repeat(query, lengths)
+
+        inside = (self.x[idxs] - px[query]) ** 2 + (self.y[idxs] - py[query]) ** 2 < r ** 2
+        if weighted:
+            fraction = np.bincount(query[inside], weights=self.weights[idxs[inside]], minlength=nb_queries) / self.totalWeight
+        else:
+            fraction = np.bincount(query[inside], minlength=nb_queries) / len(self.x)
+        return fraction[0] if scalar else fraction
@@ -0,0 +1,168 @@
+'''
+sweep.py
+
+Cedrick Argueta
+cdrckrgt@stanford.edu
+
+parameter sweeps: replays recorded (pose, obs, theta) sequences through many
+filter configurations, with no drone or policy in the loop
+'''
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from PyFEBOL import util
+from PyFEBOL.filter import DiscreteFilter, ExtendedKalmanFilter, LogDiscreteFilter, ParticleFilter, QuadtreeFilter, UnscentedKalmanFilter
+from PyFEBOL.searchdomain import SearchDomain
+from PyFEBOL.sensor import BearingOnlySensor, FOVSensor
+
+FILTERS = {'particle': ParticleFilter, 'discrete': DiscreteFilter, 'logdiscrete': LogDiscreteFilter,
+           'quadtree': QuadtreeFilter, 'ekf': ExtendedKalmanFilter, 'ukf': UnscentedKalmanFilter}
+
+def grid(**params):
+    '''
+    every combination of the given parameter lists, as config dicts:
+        grid(filter=['particle'], nb_particles=[1000, 10000], sigma=[5., 10.])
+    '''
+    names = list(params)
+    return [dict(zip(names, values)) for values in itertools.product(*(params[n] for n in names))]
+
+def sequencesFromReplay(replay, episodes=None):
+    '''
+    (pose, obs, theta) sequences of recorded episodes (see recorder.Replay), all by default
+    '''
+    episodes = range(replay.nb_episodes) if episodes is None else episodes
+    return [replay.getEpisode(e, ['pose', 'obs', 'theta']) for e in episodes]
+
+def buildFilter(config, length, rng=None):
+    '''
+    a filter from a config dict. keys (all optional):
+        - filter: 'particle' (default), 'discrete', 'logdiscrete', 'quadtree', 'ekf' or 'ukf'
+        - buckets (default 64), nb_particles (10000), maxStep (2.0),
+          velocityNoise (0.05), positionNoise (1.0) and dtype for particle filters.
+          maxStep, velocityNoise and positionNoise also apply to 'ekf' and 'ukf',
+          maxDepth (6), splitThreshold (1e-2), mergeThreshold (1e-3) to 'quadtree'.
+          'discrete' and 'logdiscrete' track a moving target if maxStep is given,
+          with motionModel ('disk' or 'gaussian')
+        - sensor: 'bearing' (default, with sigma, 10.) or 'fov' (with alpha,
+          cone_width, blind_distance: 0.1, 120., 25.)
+    '''
+    if config.get('sensor', 'bearing') == 'bearing':
+        sensor = BearingOnlySensor(config.get('sigma', 10.), rng=0)
+    else:
+        sensor = FOVSensor(config.get('alpha', 0.1), config.get('cone_width', 120.), config.get('blind_distance', 25.), rng=0)
+    domain = SearchDomain(length, init=(0.5, 0.5), rng=0) # only its length is used
+    kind = config.get('filter', 'particle')
+    buckets = config.get('buckets', 64)
+    if kind == 'particle':
+        return ParticleFilter(domain, buckets, sensor, config.get('maxStep', 2.0), config.get('nb_particles', 10000),
+                              rng=rng, dtype=config.get('dtype', np.float64),
+                              velocityNoise=config.get('velocityNoise', 0.05), positionNoise=config.get('positionNoise', 1.0))
+    if kind in ('ekf', 'ukf'):
+        return FILTERS[kind](domain, buckets, sensor, config.get('maxStep', 2.0), rng=rng,
+                             velocityNoise=config.get('velocityNoise', 0.05), positionNoise=config.get('positionNoise', 1.0))
+    if kind == 'quadtree':
+        return QuadtreeFilter(domain, buckets, sensor, config.get('maxDepth', 6),
+                              config.get('splitThreshold', 1.e-2), config.get('mergeThreshold', 1.e-3))
+    return FILTERS[kind](domain, buckets, sensor, maxStep=config.get('maxStep'), motionModel=config.get('motionModel', 'disk'))
+
+def replay(f, sequence):
+    '''
+    runs f over one sequence. returns per-step tracking error (centroid to theta),
+    entropy, and latency in seconds (the update plus computing the statistics)
+    '''
+    poses, obs, thetas = sequence['pose'], sequence['obs'], sequence['theta']
+    steps = len(obs)
+    error = np.empty(steps)
+    entropy = np.empty(steps)
+    latency = np.empty(steps)
+    for t in range(steps):
+        start = time.perf_counter()
+        f.update(tuple(poses[t]), obs[t])
+        centroid = f.centroid()
+        entropy[t] = f.entropy()
+        latency[t] = time.perf_counter() - start
+        error[t] = np.sqrt(util.getDistance2(centroid, thetas[t]))
+    return error, entropy, latency
+
+class _Worker(object):
+    def __init__(self, configs, sequences, length, seed):
+        self.configs = configs
+        self.sequences = sequences
+        self.length = length
+        self.seed = seed
+        self.filters = {} # config index -> filter, reset between sequences
+
+    def run(self, c, s):
+        rng = np.random.Generator(np.random.SFC64(np.random.SeedSequence([self.seed, c, s])))
+        f = self.filters.get(c)
+        if f is None:
+            f = self.filters[c] = buildFilter(self.configs[c], self.length, 0)
+        f.reset(rng)
+        return (c, s) + replay(f, self.sequences[s])
+
+_worker = None
+
+def _initWorker(configs, sequences, length, seed):
+    global _worker
+    _worker = _Worker(configs, sequences, length, seed)
+
+def _runTasks(tasks):
+    return [_worker.run(c, s) for c, s in tasks]
+
+def _summarize(config, errors, entropies, latencies):
+    # sequences can have different lengths, curves are averaged over the ones still running
+    steps = max(len(e) for e in errors)
+    def curve(values):
+        padded = np.full((len(values), steps), np.nan)
+        for i, v in enumerate(values):
+            padded[i, :len(v)] = v
+        return np.nanmean(padded, axis=0)
+    latency = np.concatenate(latencies)
+    return {
+        'config': config,
+        'trackingError': curve(errors),
+        'entropy': curve(entropies),
+        'finalError': float(np.mean([e[-1] for e in errors])),
+        'meanError': float(np.mean(np.concatenate(errors))),
+        'latency': {'mean': float(latency.mean()), 'median': float(np.median(latency)), 'p95': float(np.percentile(latency, 95))},
+    }
+
+def sweep(configs, sequences, length=200., workers=None, seed=0, tasksize=4):
+    '''
+    replays every sequence through a filter built from every config (see buildFilter),
+    across workers processes (os.cpu_count() if None, 0 runs in this process).
+    returns one summary per config, in order:
+        - trackingError, entropy: mean curves over the sequences, per step
+        - finalError, meanError: tracking error at the last step, and over all steps
+        - latency: mean, median and 95th percentile seconds per step
+    filters are built once per worker and reset between sequences. each (config,
+    sequence) run has its own seeded generator, so results don't depend on workers,
+    except for the latencies.
+    '''
+    workers = os.cpu_count() if workers is None else workers
+    # sequences as plain arrays, to send them to the workers only once
+    sequences = [{k: np.asarray(s[k]) for k in ('pose', 'obs', 'theta')} for s in sequences]
+    tasks = [(c, s) for c in range(len(configs)) for s in range(len(sequences))]
+    batches = [tasks[i:i + tasksize] for i in range(0, len(tasks), tasksize)]
+
+    results = {}
+    if workers == 0:
+        _initWorker(configs, sequences, length, seed)
+        for batch in batches:
+            for r in _runTasks(batch):
+                results[r[:2]] = r[2:]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(configs, sequences, length, seed)) as pool:
+            for future in as_completed([pool.submit(_runTasks, batch) for batch in batches]):
+                for r in future.result():
+                    results[r[:2]] = r[2:]
+
+    summaries = []
+    for c, config in enumerate(configs):
+        runs = [results[(c, s)] for s in range(len(sequences))]
+        summaries.append(_summarize(config, *zip(*runs)))
+    return summaries
@@ -6,7 +6,9 @@ cdrckrgt@stanford.edu
 
 utility functions
 '''
+import json
 import numpy as np
+from collections import OrderedDict
 
 def getDistance2(p0, p1):
     dx = p0[0] - p1[0]
@@ -23,3 +25,249 @@ def getTrueBearing(theta, pose):
     xr = theta[0] - pose[0]        
     yr = theta[1] - pose[1]        
     return np.degrees(np.arctan2(yr, xr)) % 360.
+
+class LRUCache(object):
+    '''
+    dict that holds at most maxsize entries, dropping the least recently used
+    '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+def entropy(p):
+    '''
+    entropy of the distribution proportional to p, same as scipy.stats.entropy
+    '''
+    p = p[p > 0]
+    p = p / p.sum()
+    return -np.sum(p * np.log(p))
+
+def maxEigenvalue(m):
+    '''
+    largest eigenvalue of a symmetric 2x2 matrix, in closed form
+    '''
+    a, b, c = m[0, 0], m[0, 1], m[1, 1]
+    return 0.5 * (a + c) + np.sqrt(0.25 * (a - c) ** 2 + b ** 2)
+
+def gridStats(f, centers):
+    '''
+    weighted moments of a 2d histogram f whose cells have the given centers along
+    both axes, plus its entropy and largest cell, in one pass over f.
+    the moments use f as is, without normalizing it.
+    returns (mu_row, mu_col, c_rowrow, c_colcol, c_rowcol), entropy, max
+    '''
+    rows = f.sum(axis=1) # mass per row index
+    cols = f.sum(axis=0) # mass per column index
+    mu_r = np.dot(rows, centers)
+    mu_c = np.dot(cols, centers)
+    c_rr = np.dot(rows, centers ** 2) - mu_r ** 2
+    c_cc = np.dot(cols, centers ** 2) - mu_c ** 2
+    c_rc = np.dot(centers, np.dot(f, centers)) - mu_r * mu_c
+    return (mu_r, mu_c, c_rr, c_cc, c_rc), entropy(f), f.max()
+
+_fhist2d = None # fast_histogram.histogram2d, imported on first use
+
+def histogram2d(x, y, bins, range, weights=None, out=None):
+    '''
+    same as fast_histogram.histogram2d: bins x bins counts (or weights) of the points,
+    first axis is x, points outside range are dropped. fast_histogram is imported the
+    first time this is called, without it a numpy bincount does the same work.
+    out, a bins x bins array, is filled and returned. with fast_histogram its result is
+    copied into out, without it the points are accumulated straight into out when it's
+    contiguous, without allocating a result
+    '''
+    global _fhist2d
+    if _fhist2d is None:
+        try:
+            from fast_histogram import histogram2d as fhist2d
+        except ImportError:
+            fhist2d = False
+        _fhist2d = fhist2d
+    if _fhist2d:
+        f = _fhist2d(x, y, bins=bins, range=range, weights=weights)
+        if out is None:
+            return f
+        np.copyto(out, f)
+        return out
+    if out is not None and not out.flags.c_contiguous:
+        np.copyto(out, histogram2d(x, y, bins, range, weights))
+        return out
+
+    (xmin, xmax), (ymin, ymax) = range
+    ix = np.floor((np.asarray(x) - xmin) * (bins / (xmax - xmin)))
+    iy = np.floor((np.asarray(y) - ymin) * (bins / (ymax - ymin)))
+    valid = (ix >= 0) & (ix < bins) & (iy >= 0) & (iy < bins)
+    cells = (ix[valid] * bins + iy[valid]).astype(np.intp)
+    if out is not None:
+        out.fill(0.)
+        # weights in out's dtype, ufunc.at is much slower when it has to cast
+        w = 1. if weights is None else np.asarray(weights)[valid].astype(out.dtype, copy=False)
+        np.add.at(out.reshape(-1), cells, w)
+        return out
+    w = None if weights is None else np.asarray(weights)[valid]
+    return np.bincount(cells, weights=w, minlength=bins * bins).astype(float).reshape(bins, bins)
+
+def getRNG(rng=None):
+    '''
+    a numpy Generator from rng, which may already be one, an int seed, or None.
+    new generators use the SFC64 bit generator, which is faster than the default.
+    None seeds from the global np.random state, so np.random.seed still makes
+    a whole run reproducible
+    '''
+    if isinstance(rng, np.random.Generator):
+        return rng
+    if rng is None:
+        rng = np.random.randint(2 ** 32)
+    return np.random.Generator(np.random.SFC64(rng))
+
+def rngState(rng):
+    '''
+    state of a Generator as a 0-d string array, so it can go in an .npz without pickling
+    '''
+    return np.array(json.dumps(rng.bit_generator.state, default=lambda a: a.tolist())) # SFC64 keeps its state in an array
+
+def setRNGState(rng, state):
+    rng.bit_generator.state = json.loads(str(state))
+
+def saveState(path, **objects):
+    '''
+    writes the getState() of every object to one .npz, e.g.
+        saveState('run.npz', filter=f, drone=d, domain=m)
+    '''
+    arrays = {}
+    for name, obj in objects.items():
+        for key, value in obj.getState().items():
+            arrays[name + '.' + key] = value
+    np.savez(path, **arrays)
+
+def loadState(path, **objects):
+    '''
+    restores objects saved with saveState, by the same names
+    '''
+    with np.load(path) as data:
+        for name, obj in objects.items():
+            prefix = name + '.'
+            obj.setState({k[len(prefix):]: data[k] for k in data.files if k.startswith(prefix)})
+
+def spawnRNGs(seed, n):
+    '''
+    n independent generators from one seed, e.g. one per worker process
+    '''
+    return [np.random.Generator(np.random.SFC64(s)) for s in np.random.SeedSequence(seed).spawn(n)]
+
+class NoiseBuffer(object):
+    '''
+    standard normal draws generated in big blocks and handed out in order, so that
+    a filter drawing a few thousand numbers per step makes one generator call every
+    many steps instead of several per step. take(n) returns a view into the block,
+    callers may overwrite it (those draws are used up anyway)
+
+    the block holds steps calls' worth of draws (draws per call), capped at maxSize
+    numbers but never less than one call, so it stays a bounded multiple of what the
+    owner draws per step. it grows the same way if a call asks for more
+    '''
+    def __init__(self, rng, draws, steps=8, maxSize=1 << 20, dtype=np.float64):
+        self.rng = rng
+        self.steps = steps
+        self.maxSize = maxSize
+        self.dtype = dtype
+        self.size = self._blockSize(draws)
+        self.block = np.empty(0, dtype=dtype)
+        self.position = 0
+        self.blockState = None # generator state the block was drawn from
+
+    def _blockSize(self, draws):
+        return max(draws, min(self.steps * draws, self.maxSize))
+
+    def take(self, n):
+        if self.position + n > len(self.block):
+            if len(self.block) < n:
+                self.size = max(self.size, self._blockSize(n))
+                self.block = np.empty(self.size, dtype=self.dtype)
+            self.blockState = rngState(self.rng)
+            self.rng.standard_normal(out=self.block, dtype=self.dtype)
+            self.position = 0
+        noise = self.block[self.position:self.position + n]
+        self.position += n
+        return noise
+
+    def getState(self):
+        # the block is redrawn from blockState on restore, rather than saved
+        if self.blockState is None:
+            return {'noisePosition': np.array(0), 'noiseSize': np.array(0)}
+        return {'noiseState': self.blockState, 'noisePosition': np.array(self.position), 'noiseSize': np.array(len(self.block))}
+
+    def setState(self, state):
+        '''
+        restores the block and position. call before restoring the generator's own state
+        '''
+        self.block = np.empty(int(state['noiseSize']), dtype=self.dtype)
+        self.position = int(state['noisePosition'])
+        self.blockState = None
+        if 'noiseState' in state:
+            self.blockState = state['noiseState']
+            setRNGState(self.rng, self.blockState)
+            self.rng.standard_normal(out=self.block, dtype=self.dtype)
+
+class FrameStack(object):
+    '''
+    the last k frames of some shape, e.g. beliefs for a frame-stacking learner.
+    every frame is stored twice, k slots apart, in a [2k, *shape] buffer, so the
+    last k frames are always one contiguous slice and stacked() is a view, not a copy.
+
+    to avoid copying a frame in, write it straight into next() and then commit():
+        f.getBelief(out=stack.next())
+        stack.commit()
+    push(frame) does both for a frame that already exists.
+    the view from stacked() changes with every commit, copy it to keep it.
+    '''
+    def __init__(self, k, shape, dtype=np.float64):
+        self.k = k
+        self.buffer = np.zeros((2 * k,) + tuple(shape), dtype=dtype)
+        self.position = 0 # slot of the next frame
+
+    def next(self):
+        return self.buffer[self.position]
+
+    def commit(self):
+        self.buffer[self.position + self.k] = self.buffer[self.position]
+        self.position = (self.position + 1) % self.k
+        return self.stacked()
+
+    def push(self, frame):
+        np.copyto(self.next(), frame)
+        return self.commit()
+
+    def stacked(self):
+        '''
+        [k, *shape] view of the last k frames, oldest first
+        '''
+        return self.buffer[self.position:self.position + self.k]
+
+    def reset(self, frame=None):
+        '''
+        fills every slot with frame (zeros if None)
+        '''
+        if frame is None:
+            self.buffer.fill(0)
+        else:
+            self.buffer[...] = frame
+        self.position = 0
@@ -0,0 +1,229 @@
+'''
+vecenv.py
+
+Cedrick Argueta
+cdrckrgt@stanford.edu
+
+batched simulation of many independent localization episodes
+'''
+import numpy as np
+from PyFEBOL import util
+from PyFEBOL.resample import StratifiedResampler
+
+class VecEnv(object):
+    '''
+    steps n_envs independent episodes at once. each episode is a drone, a target
+    and a particle filter, but instead of one object per episode everything is
+    kept in arrays with a leading [n_envs] axis:
+        - poses: [n_envs, 3] drone x, y, heading
+        - thetas: [n_envs, 2] target x, y
+        - x/y/dx/dy_particles, weights: [n_envs, nb_particles]
+
+    a step does the same thing as Drone.act, SearchDomain.moveTarget,
+    Drone.observe and ParticleFilter.update, but with a single call to the
+    sensor for all episodes.
+
+    rng is a numpy Generator or seed (see util.getRNG) for the episode starts,
+    process noise and the default resampler. velocityNoise and positionNoise are
+    the process noise standard deviations, as in ParticleFilter.
+    '''
+    def __init__(self, n_envs, length, buckets, sensor, maxStep, headingMaxStep, nb_particles, policy=None, init=None, pose=None, resampler=None, rng=None, velocityNoise=0.05, positionNoise=1.0):
+        self.n_envs = n_envs
+        self.length = length
+        self.buckets = buckets
+        self.sensor = sensor
+        self.maxStep = maxStep
+        self.velocityNoise = velocityNoise
+        self.positionNoise = positionNoise
+        self.headingMaxStep = headingMaxStep
+        self.nb_particles = nb_particles
+        self.cellSize = length / buckets
+        self.policy = policy # target policy, must support action(k=n_envs)
+        self.init = init # fixed target start, as a fraction of length (see SearchDomain)
+        self.pose = pose # fixed drone start (x, y, heading). random if None
+        self.rng = util.getRNG(rng)
+        self.noise = util.NoiseBuffer(self.rng, 4 * n_envs * nb_particles)
+        self.resampler = resampler if resampler is not None else StratifiedResampler(rng=self.rng)
+
+        self.poses = np.zeros((n_envs, 3))
+        self.thetas = np.zeros((n_envs, 2))
+        self.x_particles = np.zeros((n_envs, nb_particles))
+        self.y_particles = np.zeros((n_envs, nb_particles))
+        self.dx_particles = np.zeros((n_envs, nb_particles))
+        self.dy_particles = np.zeros((n_envs, nb_particles))
+        self.weights = np.zeros((n_envs, nb_particles))
+        self.belief = np.zeros((n_envs, 1, buckets, buckets))
+        self.prob = np.empty((n_envs, nb_particles)) # likelihood workspace
+        self.obs = None
+        self.reset()
+
+    def reset(self, envs=None):
+        '''
+        restarts the episodes in envs (all of them if None), returns the belief of all envs
+        '''
+        if envs is None:
+            envs = np.arange(self.n_envs)
+        envs = np.atleast_1d(envs)
+        if envs.dtype == bool:
+            envs = np.flatnonzero(envs)
+        n = len(envs)
+
+        if self.init:
+            self.thetas[envs] = np.asarray(self.init) * self.length
+        else:
+            self.thetas[envs] = self.rng.random((n, 2)) * self.length
+
+        if self.pose is not None:
+            self.poses[envs] = self.pose
+        else:
+            self.poses[envs, :2] = self.rng.random((n, 2)) * self.length
+            self.poses[envs, 2] = self.rng.random(n) * 360.
+
+        self._initParticles(envs)
+        self.belief[envs] = 1. / (self.buckets ** 2)
+        return self.belief
+
+    def _initParticles(self, envs):
+        shape = (len(envs), self.nb_particles)
+        self.x_particles[envs] = self.rng.uniform(0, self.length, shape)
+        self.dx_particles[envs] = self.rng.uniform(-self.maxStep, self.maxStep, shape)
+        self.y_particles[envs] = self.rng.uniform(0, self.length, shape)
+        self.dy_particles[envs] = self.rng.uniform(-self.maxStep, self.maxStep, shape)
+        self.weights[envs] = 1. / self.nb_particles
+
+    def getPoses(self):
+        return self.poses
+
+    def getThetas(self):
+        return self.thetas
+
+    def getBelief(self, out=None):
+        '''
+        returns [n_envs, 1, buckets, buckets] beliefs, laid out like ParticleFilter.getBelief.
+        out, if given, is filled in and returned instead
+        '''
+        if out is not None:
+            np.copyto(out, self.belief)
+            return out
+        return self.belief
+
+    def step(self, actions, nb_act_repeat=1):
+        '''
+        actions is [n_envs, 3], one (dx, dy, heading) action per env as in Policy.makeActionList
+        '''
+        actions = np.asarray(actions, dtype=float).reshape(self.n_envs, 3)
+        self._act(actions, nb_act_repeat)
+        self._moveTargets(nb_act_repeat)
+        self.obs = self.observe()
+        self.update(self.obs, nb_act_repeat)
+        return self.belief
+
+    def _act(self, actions, nb_act_repeat):
+        for _ in range(nb_act_repeat):
+            self.poses[:, :2] += actions[:, :2]
+            np.clip(self.poses[:, :2], 0, self.length, out=self.poses[:, :2])
+            self.poses[:, 2] = (self.poses[:, 2] + self.headingMaxStep * actions[:, 2]) % 360.
+
+    def _moveTargets(self, nb_act_repeat):
+        if self.policy is None:
+            return
+        for _ in range(nb_act_repeat):
+            action = np.atleast_2d(self.policy.action(k=self.n_envs)).astype(float)
+            self.thetas += action[:, :2]
+            np.clip(self.thetas, 0, self.length, out=self.thetas)
+
+    def observe(self):
+        '''
+        one observation per env, [n_envs]
+        '''
+        theta = (self.thetas[:, 0], self.thetas[:, 1])
+        pose = (self.poses[:, 0], self.poses[:, 1], self.poses[:, 2])
+        return self.sensor.observe(theta, pose)
+
+    def update(self, obs, nb_act_repeat=1):
+        self._predictParticles(nb_act_repeat)
+        self._updateParticles(obs)
+        self._resampleParticles()
+        self._updateBelief()
+
+    def _predictParticles(self, nb_act_repeat=1):
+        shape = self.x_particles.shape
+        noise = self.noise.take(4 * self.x_particles.size).reshape((4,) + shape)
+        self.dx_particles += noise[0] * self.velocityNoise
+        self.dy_particles += noise[1] * self.velocityNoise
+
+        self.x_particles += nb_act_repeat * self.dx_particles + noise[2] * self.positionNoise
+        self.y_particles += nb_act_repeat * self.dy_particles + noise[3] * self.positionNoise
+
+        np.clip(self.dx_particles, -self.maxStep, self.maxStep, out=self.dx_particles)
+        np.clip(self.dy_particles, -self.maxStep, self.maxStep, out=self.dy_particles)
+
+    def _updateParticles(self, obs):
+        # pose and obs get a trailing axis so they broadcast against [n_envs, nb_particles]
+        pose = (self.poses[:, 0, np.newaxis], self.poses[:, 1, np.newaxis], self.poses[:, 2, np.newaxis])
+        prob = self.sensor.prob((self.x_particles, self.y_particles), pose, np.asarray(obs)[:, np.newaxis], out=self.prob)
+        self.weights *= prob
+        np.nan_to_num(self.weights, copy=False)
+        self.weights += 1.e-300
+        self.weights /= self.weights.sum(axis=1, keepdims=True)
+        assert np.all(np.isfinite(self.weights)), 'weights contains nan values: weights: {}, prob: {}'.format(self.weights, prob)
+
+    def _resampleParticles(self):
+        envs = np.flatnonzero(self.resampler.needsResample(self.weights))
+        if len(envs) == 0:
+            return
+        idxs = self.resampler.resample(self.weights[envs])
+        self.x_particles[envs] = np.take_along_axis(self.x_particles[envs], idxs, axis=1)
+        self.y_particles[envs] = np.take_along_axis(self.y_particles[envs], idxs, axis=1)
+        self.dx_particles[envs] = np.take_along_axis(self.dx_particles[envs], idxs, axis=1)
+        self.dy_particles[envs] = np.take_along_axis(self.dy_particles[envs], idxs, axis=1)
+        self.weights[envs] = 1. / self.nb_particles
+
+    def _updateBelief(self):
+        # same as ParticleFilter._updateBelief: histogram of a 10% sample of particles,
+        # binned over [0, length + 1] like util.histogram2d
+        n = self.nb_particles
+        sampled = self.rng.integers(n, size=(self.n_envs, int(n / 10)))
+        x = np.take_along_axis(self.x_particles, sampled, axis=1)
+        y = np.take_along_axis(self.y_particles, sampled, axis=1)
+        w = np.take_along_axis(self.weights, sampled, axis=1)
+
+        scale = self.buckets / (self.length + 1)
+        ix = np.floor(x * scale)
+        iy = np.floor(y * scale)
+        valid = (ix >= 0) & (ix < self.buckets) & (iy >= 0) & (iy < self.buckets)
+        env = np.broadcast_to(np.arange(self.n_envs)[:, np.newaxis], ix.shape)
+        flat = ((env * self.buckets + ix) * self.buckets + iy)[valid].astype(int)
+        f = np.bincount(flat, weights=w[valid], minlength=self.n_envs * self.buckets ** 2)
+        self.belief = f.reshape(self.n_envs, 1, self.buckets, self.buckets)
+        assert np.all(np.isfinite(self.belief)), 'belief matrix contains nan values. weights: {}'.format(self.weights)
+
+        # belief concentrated outside the search domain, start these envs' particles over
+        empty = np.flatnonzero(~self.belief.any(axis=(1, 2, 3)))
+        if len(empty):
+            self._initParticles(empty)
+            self.belief[empty] = 1. / (self.buckets ** 2)
+
+    def entropy(self):
+        '''
+        entropy of each env's belief, [n_envs]
+        '''
+        p = self.belief.reshape(self.n_envs, -1)
+        p = p / p.sum(axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logp = np.where(p > 0, np.log(p), 0.)
+        return -np.sum(p * logp, axis=1)
+
+    def centroid(self):
+        '''
+        weighted particle mean of each env, [n_envs, 2]
+        '''
+        mean_x = np.sum(self.x_particles * self.weights, axis=1)
+        mean_y = np.sum(self.y_particles * self.weights, axis=1)
+        return np.stack([mean_x, mean_y], axis=1)
+
+    def getDistance2(self):
+        '''
+        squared distance between each drone and its target, [n_envs]
+        '''
+        return util.getDistance2(self.poses.T, self.thetas.T)
@@ -8,4 +8,6 @@ setup(name='PyFEBOL',
       author_email='cedrick@cs.stanford.edu',
       license='MIT',
       packages=['PyFEBOL'],
+      install_requires=['numpy'],
+      extras_require={'fast': ['fast_histogram']},
       zip_safe=False)